@@ -0,0 +1,100 @@
+###########################################
+# Tello detector / tracker benchmark
+# Author: fvilmos
+###########################################
+
+from utils.dnnobjectdetect import DnnObjectDetect
+from utils import benchmark
+import os
+import sys
+import argparse
+
+
+# default model files, see data folder
+MODELS = {'Face':('./data/opencv_face_detector.caffemodel','./data/deploy.prototxt'),
+          'Person':('./data/frozen_inference_graph.pb','./data/ssd_mobilenet_v1_coco_2017_11_17.pbtxt')}
+
+
+if __name__=="__main__":
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Tello benchmark. Measures detector speed over recorded clips, replays the tracking pipeline against a simulated drone, compares with a stored baseline.\n')
+    parser.add_argument('-clips', type=str, nargs='+', help='Recorded video clips', required=True)
+    parser.add_argument('-obj', type=str, help='Detectors to measure, comma separated. [Face, Person], default = Face,Person', default='Face,Person')
+    parser.add_argument('-face_model', type=str, help='Face caffe model', default=MODELS['Face'][0])
+    parser.add_argument('-face_proto', type=str, help='Face prototxt', default=MODELS['Face'][1])
+    parser.add_argument('-person_model', type=str, help='Person tensorflow model', default=MODELS['Person'][0])
+    parser.add_argument('-person_proto', type=str, help='Person pbtxt', default=MODELS['Person'][1])
+    parser.add_argument('-dconf', type=float, help='Detection confidence, default = 0.7', default=0.7)
+    parser.add_argument('-sizes', type=str, help='Network input sizes, default = 300x300,200x200', default='300x300,200x200')
+    parser.add_argument('-threads', type=str, help='OpenCV thread counts, default = 1,2,4', default='1,2,4')
+    parser.add_argument('-frames', type=int, help='Frames used from each clip, default = 300', default=300)
+    parser.add_argument('-vsize', type=str, help='Video size received from tello, default = 640x480', default='640x480')
+    parser.add_argument('-replay', action='store_true', help='Replay the tracking pipeline against a simulated drone, with the first -threads count')
+    parser.add_argument('-baseline', type=str, help='JSON baseline to compare with', default='')
+    parser.add_argument('-save', type=str, help='Store results as JSON baseline', default='')
+    parser.add_argument('-tolerance', type=float, help='Allowed relative regression, default = 0.1', default=0.1)
+
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in s.split('x')) for s in args.sizes.split(',')]
+    threads = [int(t) for t in args.threads.split(',')]
+    vsize = tuple(int(v) for v in args.vsize.split('x'))
+
+    models = {'Face':(args.face_model, args.face_proto), 'Person':(args.person_model, args.person_proto)}
+
+    # a missing baseline must fail before the run, not pass after it
+    baseline = None
+    if args.baseline != '':
+        try:
+            baseline = benchmark.load_baseline(args.baseline)
+        except FileNotFoundError:
+            print ("baseline not found: " + args.baseline)
+            sys.exit(1)
+
+    results = {}
+
+    for obj in args.obj.split(','):
+        model, proto = models[obj]
+        if not os.path.isfile(model) or not os.path.isfile(proto):
+            print ("skip {}, model not found: {}".format(obj, model))
+            continue
+
+        detector = DnnObjectDetect(model, proto, CONFIDENCE=args.dconf, DETECT=obj)
+
+        for clip in args.clips:
+            frames = benchmark.load_clip(clip, vsize, args.frames)
+            if len(frames) == 0:
+                print ("skip {}, no frames".format(clip))
+                continue
+            cname = os.path.basename(clip)
+
+            for size in sizes:
+                for th in threads:
+                    name = "{}/{}/{}x{}/t{}".format(obj, cname, size[0], size[1], th)
+                    res = benchmark.bench_detector(detector, frames, size=size, threads=th)
+                    results[name] = res
+                    print ("{:<40} fps: {:7.2f} p50: {:7.2f} ms p90: {:7.2f} ms inference p90: {:7.2f} ms rss: {:7.1f} MB".format(
+                        name, res['fps'], res['latency_ms']['p50'], res['latency_ms']['p90'], res['stages_ms']['inference']['p90'], res['peak_rss_mb']))
+
+            if args.replay:
+                name = "{}/{}/replay".format(obj, cname)
+                res = benchmark.bench_tracking(clip, model, proto, detect=obj, confidence=args.dconf, image_size=vsize, maxframes=args.frames, threads=threads[0])
+                results[name] = res
+                print ("{:<40} cmd rate: {:6.2f} Hz interval p90: {:7.2f} ms tracking: {:5.2f} rss: {:7.1f} MB".format(
+                    name, res['command_rate_hz'], res['command_interval_ms']['p90'], res['tracking_ratio'], res['peak_rss_mb']))
+
+    # compare before saving, the baseline may be overwritten
+    regressions = []
+    if baseline is not None:
+        regressions = benchmark.compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print ("REGRESSION " + r)
+
+    if args.save != '':
+        benchmark.save_baseline(args.save, results)
+
+    if len(regressions) > 0:
+        sys.exit(1)
+    if baseline is not None:
+        print ("no regression against " + args.baseline)
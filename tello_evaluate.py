@@ -0,0 +1,65 @@
+###########################################
+# Tello offline tracking evaluation
+# Author: fvilmos
+###########################################
+
+from utils import evaluate
+import json
+import argparse
+
+
+if __name__=="__main__":
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Tello tracking evaluation. Replays a recorded clip through the detector and tracker, sweeps parameter grids in parallel, prints a ranked table. Parameter values are comma separated lists.\n')
+    parser.add_argument('-video', type=str, help='Recorded video clip', required=True)
+    parser.add_argument('-ann', type=str, help='Box annotations, lines of: frame x y w h', default='')
+    parser.add_argument('-model', type=str, help='DNN model caffe or tensorflow, see data folder', default='./data/opencv_face_detector.caffemodel')
+    parser.add_argument('-proto', type=str, help='Prototxt file, see data folder', default='./data/deploy.prototxt')
+    parser.add_argument('-obj', type=str, help='Type of object to track. [Face, Person], default = Face', default='Face')
+    parser.add_argument('-vsize', type=str, help='Video size received from tello, default = 640x480', default='640x480')
+    parser.add_argument('-frames', type=int, help='Frames to replay, 0 - full clip', default=0)
+    parser.add_argument('-dconf', type=str, help='Detection confidence', default='0.7')
+    parser.add_argument('-cycle', type=str, help='Detection periodicity (cycle_activation)', default='10')
+    parser.add_argument('-kvscale', type=str, help='Horizontal command scale, changes the commands only (cmd_jitter)', default='6')
+    parser.add_argument('-khscale', type=str, help='Vertical command scale, changes the commands only (cmd_jitter)', default='4')
+    parser.add_argument('-distscale', type=str, help='Distance command scale, changes the commands only (cmd_jitter)', default='3')
+    parser.add_argument('-pnoise', type=str, help='Kalman process noise, target estimate (centre_err, lost_tracks)', default='0.01')
+    parser.add_argument('-mnoise', type=str, help='Kalman measurement noise, target estimate (centre_err, lost_tracks)', default='1.0')
+    parser.add_argument('-proc', type=int, help='Worker processes, 0 - all cores', default=0)
+    parser.add_argument('-rank', type=str, help='Ranking key {}'.format(list(evaluate.RANK_KEYS.keys())), default='f1')
+    parser.add_argument('-top', type=int, help='Rows to print, 0 - all', default=0)
+    parser.add_argument('-out', type=str, help='Store the ranked results as JSON', default='')
+
+    args = parser.parse_args()
+
+    values = {'dconf':[float(v) for v in args.dconf.split(',')],
+              'cycle_activation':[int(v) for v in args.cycle.split(',')],
+              'kvscale':[float(v) for v in args.kvscale.split(',')],
+              'khscale':[float(v) for v in args.khscale.split(',')],
+              'distscale':[float(v) for v in args.distscale.split(',')],
+              'pnoise':[float(v) for v in args.pnoise.split(',')],
+              'mnoise':[float(v) for v in args.mnoise.split(',')]}
+
+    annotations = evaluate.load_annotations(args.ann) if args.ann != '' else None
+
+    # without annotations quality is measured by lost tracks
+    key = args.rank
+    if annotations is None and key in ['f1','recall','precision','centre_err']:
+        key = 'lost_tracks'
+
+    results = evaluate.sweep(values, processes=args.proc if args.proc > 0 else None,
+                             clip=args.video, model=args.model, proto=args.proto, detect=args.obj,
+                             annotations=annotations, image_size=tuple(int(v) for v in args.vsize.split('x')),
+                             maxframes=args.frames)
+
+    results = evaluate.rank(results, key)
+    if args.top > 0:
+        results = results[:args.top]
+
+    print ("ranked by: " + key)
+    print (evaluate.table(results))
+
+    if args.out != '':
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -20,7 +20,11 @@ if __name__=="__main__":
     tello = TelloConnect(DEBUG=False)
     
     # wait till connected, than proceed
-    tello.wait_till_connected()
+    try:
+        tello.wait_till_connected()
+    except ConnectionError as e:
+        print ("connection failed: " + str(e))
+        exit()
     tello.start_communication()
 
 
@@ -3,8 +3,11 @@
 # Author: fvilmos
 ###########################################
 
-from utils.telloconnect import TelloConnect
-from utils.followobject import FollowObject
+from utils.startup import StartupOrchestrator
+from utils.redact import Redactor
+from utils.framering import FrameRingWriter
+from utils.egomotion import EgoMotion
+from utils.linksupervisor import LinkSupervisor
 import signal
 import cv2
 import argparse
@@ -25,6 +28,13 @@ if __name__=="__main__":
     parser.add_argument('-tv', type=bool, help='Vertical tracking', default=True)
     parser.add_argument('-td', type=bool, help='Distance tracking', default=True)
     parser.add_argument('-tr', type=bool, help='Rotation tracking', default=True)
+    parser.add_argument('-crate', type=float, help='Fixed control loop rate [Hz] (e.g. 20-50), 0 - command after each detection, default = 0', default=0)
+    parser.add_argument('-lowlat', type=bool, help='Low latency video ingest, always the newest frame is processed', default=False)
+    parser.add_argument('-shm', type=str, help='Publish the frames into this named shared memory ring, see tello_shm_viewer.py', default='')
+    parser.add_argument('-redact', type=str, help='Redact the detections in the recorded / streamed video. [none, pixelate, blur], default = none', default='none')
+    parser.add_argument('-ego', type=bool, help='Compensate the image motion caused by the drone, uses the tello state stream', default=False)
+    parser.add_argument('-failsafe', type=str, help='Link supervisor, action if a link (commands, state, video) is lost. [off, none, hover, land], default = off', default='off')
+    parser.add_argument('-timeout', type=float, help='Connection timeout [s], 0 - wait forever, default = 30', default=30)
 
 
     args = parser.parse_args()
@@ -46,12 +56,20 @@ if __name__=="__main__":
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
 
+    # model load, connection and video stream start run concurrently
     if args.debug and args.video is not None:
-        tello = TelloConnect(DEBUG=True, VIDEO_SOURCE=args.video)
+        startup = StartupOrchestrator(MODEL=args.model, PROTO=args.proto, CONFIDENCE=args.dconf, DETECT=args.obj, IMAGE_SIZE=imgsize,
+                                      TIMEOUT=args.timeout if args.timeout > 0 else None, CONTROL_RATE=args.crate, DEBUG=True, VIDEO_SOURCE=args.video, LOW_LATENCY=args.lowlat, SHM_NAME=args.shm)
     else:
-        tello = TelloConnect(DEBUG=False)
-    tello.set_image_size(imgsize)
-    
+        startup = StartupOrchestrator(MODEL=args.model, PROTO=args.proto, CONFIDENCE=args.dconf, DETECT=args.obj, IMAGE_SIZE=imgsize,
+                                      TIMEOUT=args.timeout if args.timeout > 0 else None, CONTROL_RATE=args.crate, DEBUG=False, LOW_LATENCY=args.lowlat, SHM_NAME=args.shm)
+
+    try:
+        tello, fobj = startup.run()
+    except Exception as e:
+        print ("startup failed: " + str(e))
+        exit()
+
     videow = cv2.VideoWriter('out.avi',cv2.VideoWriter_fourcc('M','J','P','G'), 30, (imgsize))
 
     if tello.debug == True: pspeed = 30
@@ -59,14 +77,33 @@ if __name__=="__main__":
     # ask stats periodically
     tello.add_periodic_event('wifi?',40,'Wifi')
 
-    # wait till connected, than proceed
-    tello.wait_till_connected()
-    tello.start_communication()
-    tello.start_video()
-
-    fobj = FollowObject(tello, MODEL=args.model, PROTO=args.proto, CONFIDENCE=args.dconf, DEBUG=False, DETECT=args.obj)
     fobj.set_tracking( HORIZONTAL=args.th, VERTICAL=args.tv,DISTANCE=args.td, ROTATION=args.tr)
 
+    # ego-motion compensation, updated at telemetry rate
+    if args.ego:
+        ego = EgoMotion(IMAGE_SIZE=imgsize)
+        tello.add_state_listener(ego.update)
+        fobj.set_ego_motion(ego)
+
+    # privacy redaction of the recorded video and of the shared memory stream (<shm>_redacted), in its own worker
+    redactor = None
+    rring = None
+    if args.redact != 'none':
+        redactor = Redactor(MODE=args.redact)
+        redactor.add_sink(lambda f: videow.write(f) if writevideo else None)
+        if args.shm != '':
+            rring = FrameRingWriter(args.shm + '_redacted', SHAPE=(imgsize[1],imgsize[0],3))
+            redactor.add_sink(rring.publish)
+
+    # link supervision, failsafe on lost commands / state / video, reconnect with backoff
+    supervisor = None
+    if args.failsafe != 'off':
+        supervisor = LinkSupervisor(tello, FAILSAFE={'cmd':args.failsafe, 'state':args.failsafe, 'video':args.failsafe})
+        supervisor.start()
+
+    # print the startup breakdown once the first command is sent
+    startup_reported = False
+
     while True:
 
         try:
@@ -86,6 +123,10 @@ if __name__=="__main__":
             tello.stop_communication()
             break
         
+        if not startup_reported and tello.t_first_rc is not None:
+            print (startup.report())
+            startup_reported = True
+
         fobj.draw_detections(imghud, ANONIMUS=False)
         cv2.imshow("TelloCamera",imghud)
         
@@ -94,11 +135,16 @@ if __name__=="__main__":
             if writevideo == False : writevideo = True
             else: writevideo = False
         
-        if writevideo == True:
+        # detections are reused, no extra inference
+        if redactor is not None:
+            if writevideo == True or rring is not None:
+                redactor.put(img, fobj.det)
+        elif writevideo == True:
             videow.write(img)
 
         # exit
         if k == ord('q'):
+            tello.stop_video()
             tello.stop_communication()
             break
 
@@ -120,6 +166,15 @@ if __name__=="__main__":
         if k == ord('d'):
             tello.send_cmd('ccw 20')
 
+    if supervisor is not None:
+        supervisor.stop()
+        print ("link: " + str(supervisor.get_metrics()))
+    if redactor is not None:
+        redactor.stop()
+        print ("redaction: " + str(redactor.get_stats()))
+    if rring is not None: rring.close()
+    videow.release()
+
     cv2.destroyAllWindows()
 
 
@@ -0,0 +1,54 @@
+###########################################
+# Tello tracker, pipeline from config file
+# Author: fvilmos
+###########################################
+
+from utils.pipeline import Pipeline
+import signal
+import argparse
+
+
+if __name__=="__main__":
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Tello tracker built from a JSON pipeline config, see data/pipeline_person.json. keys (+enter): t-takeoff, l-land, q-quit\n')
+    parser.add_argument('-config', type=str, help='Pipeline config file', default='./data/pipeline_person.json')
+
+    args = parser.parse_args()
+
+    # signal handler
+    def signal_handler(sig, frame):
+        raise Exception
+
+    # capture signals
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    pipeline = Pipeline.from_file(args.config)
+    tello = pipeline.context.get('tello')
+
+    try:
+        pipeline.start()
+    except Exception as e:
+        print ("startup failed: " + str(e))
+        exit()
+
+    while pipeline.running():
+
+        try:
+            k = input()
+
+            # exit
+            if k == 'q':
+                break
+
+            if tello is not None and k == 't':
+                tello.send_cmd('takeoff')
+
+            if tello is not None and k == 'l':
+                tello.send_cmd('land')
+
+        except Exception:
+            break
+
+    pipeline.stop()
@@ -0,0 +1,61 @@
+###########################################
+# Tello shared memory frame viewer / recorder
+# Author: fvilmos
+###########################################
+
+from utils.framering import FrameRingReader
+import signal
+import cv2
+import argparse
+
+
+if __name__=="__main__":
+
+    # input arguments
+    parser = argparse.ArgumentParser(description='Attach to the frames published by tello_object_tracking.py -shm NAME, display and / or record them. keys: q-quit\n')
+    parser.add_argument('-shm', type=str, help='Shared memory name, default = tello_frames', default='tello_frames')
+    parser.add_argument('-record', type=str, help='Record to this video file, default = no recording', default='')
+    parser.add_argument('-show', type=bool, help='Display the frames, default = True', default=True)
+
+    args = parser.parse_args()
+
+    # signal handler
+    def signal_handler(sig, frame):
+        raise Exception
+
+    # capture signals
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    ring = FrameRingReader(args.shm)
+    videow = None
+    img = None
+
+    while True:
+        try:
+            meta, img = ring.wait(timeout=1.0)
+
+            # wait for valid frame
+            if meta is None: continue
+
+            if args.record != '':
+                if videow is None:
+                    videow = cv2.VideoWriter(args.record,cv2.VideoWriter_fourcc('M','J','P','G'), 30, (meta['width'],meta['height']))
+                videow.write(img)
+
+            if args.show:
+                cv2.imshow("TelloShm",img)
+                if cv2.waitKey(1) == ord('q'): break
+
+            # frame overwritten while used
+            if not ring.valid(meta):
+                print ("frame {} overwritten".format(meta['seq']))
+
+        except Exception:
+            break
+
+    # release the view before detaching
+    img = None
+    if videow is not None: videow.release()
+    ring.close()
+    cv2.destroyAllWindows()
@@ -0,0 +1,258 @@
+"""
+Detector and tracker benchmark helpers, results are plain dictionaries,
+so can be stored as JSON baseline and compared later
+
+Author: Vilmos Fernengel
+"""
+
+import os
+import time
+import json
+import cv2
+import numpy as np
+from . import simtello
+from . import followobject
+
+
+def latency_stats(samples):
+    """Latency percentiles
+
+    Args:
+        samples (list): durations in seconds
+
+    Returns:
+        dict: mean, p50, p90, p99, max in ms
+    """
+    if len(samples) == 0:
+        return {'mean':0.0, 'p50':0.0, 'p90':0.0, 'p99':0.0, 'max':0.0}
+
+    val = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p90, p99 = np.percentile(val, [50, 90, 99])
+
+    return {'mean':round(float(val.mean()),3), 'p50':round(float(p50),3), 'p90':round(float(p90),3),
+            'p99':round(float(p99),3), 'max':round(float(val.max()),3)}
+
+
+def rss_mb():
+    """Current resident memory of the process
+
+    Returns:
+        float: RSS in MB, peak RSS if /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0*1024.0)
+    except Exception:
+        # ru_maxrss is in KB on linux
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def load_clip(path, image_size=(640,480), maxframes=300):
+    """Decode a clip into memory, so decoding is not part of the measurement
+
+    Args:
+        path (str): video file
+        image_size (tuple, optional): frame size, as received from tello. Defaults to (640,480).
+        maxframes (int, optional): max frames to load. Defaults to 300.
+
+    Returns:
+        list: frames
+    """
+    frames = []
+    video = cv2.VideoCapture(path)
+    while len(frames) < maxframes:
+        ret, frame = video.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, image_size))
+    video.release()
+
+    return frames
+
+
+def bench_detector(detector, frames, size=(300,300), threads=1, warmup=5):
+    """Run the detector over frames
+
+    Args:
+        detector (DnnObjectDetect): detector to measure
+        frames (list): input frames
+        size (tuple, optional): network input size. Defaults to (300,300).
+        threads (int, optional): OpenCV threads. Defaults to 1.
+        warmup (int, optional): frames processed before measuring. Defaults to 5.
+
+    Returns:
+        dict: fps, latency percentiles per stage, peak memory, detection rate
+    """
+    # restored at the end, later runs must not inherit the thread count
+    prev_threads = cv2.getNumThreads()
+    cv2.setNumThreads(threads)
+    try:
+        return _bench_detector(detector, frames, size, warmup)
+    finally:
+        cv2.setNumThreads(prev_threads)
+
+
+def _bench_detector(detector, frames, size, warmup):
+    """Measurement loop of bench_detector()
+    """
+    for img in frames[:warmup]:
+        detector.detect(img, size=size)
+
+    stages = {k:[] for k in detector.stage_times}
+    total = []
+    hits = 0
+    peak = rss_mb()
+
+    t_start = time.perf_counter()
+    for img in frames:
+        t0 = time.perf_counter()
+        _, det = detector.detect(img, size=size)
+        total.append(time.perf_counter() - t0)
+
+        for k,v in detector.stage_times.items():
+            stages[k].append(v)
+        if len(det) > 0: hits += 1
+        peak = max(peak, rss_mb())
+    duration = time.perf_counter() - t_start
+
+    return {'frames':len(frames),
+            'fps':round(len(frames)/duration,3) if duration > 0 else 0.0,
+            'latency_ms':latency_stats(total),
+            'stages_ms':{k:latency_stats(v) for k,v in stages.items()},
+            'peak_rss_mb':round(peak,1),
+            'detection_rate':round(hits/max(1,len(frames)),3)}
+
+
+def bench_tracking(clip, model, proto, detect='Face', confidence=0.7, image_size=(640,480), maxframes=300, realtime=True, threads=1):
+    """Replay the full tracking pipeline against a simulated drone
+
+    Args:
+        clip (str): video file
+        model (str): DNN model
+        proto (str): prototxt
+        detect (str, optional): ['Face', 'Person']. Defaults to 'Face'.
+        confidence (float, optional): detection confidence. Defaults to 0.7.
+        image_size (tuple, optional): frame size. Defaults to (640,480).
+        maxframes (int, optional): frames to replay. Defaults to 300.
+        realtime (bool, optional): keep the clip frame rate. Defaults to True.
+        threads (int, optional): OpenCV threads. Defaults to 1.
+
+    Returns:
+        dict: command rate, command interval percentiles, tracking ratio, peak memory
+    """
+    prev_threads = cv2.getNumThreads()
+    cv2.setNumThreads(threads)
+    try:
+        return _bench_tracking(clip, model, proto, detect, confidence, image_size, maxframes, realtime)
+    finally:
+        cv2.setNumThreads(prev_threads)
+
+
+def _bench_tracking(clip, model, proto, detect, confidence, image_size, maxframes, realtime):
+    """Replay loop of bench_tracking()
+    """
+    tello = simtello.SimTello(VIDEO_SOURCE=clip, IMAGE_SIZE=image_size, REALTIME=realtime, MAXFRAMES=maxframes)
+    fobj = followobject.FollowObject(tello, MODEL=model, PROTO=proto, CONFIDENCE=confidence, DETECT=detect)
+
+    peak = rss_mb()
+    t_start = time.perf_counter()
+    while True:
+        img = tello.get_frame()
+        if img is None:
+            break
+        fobj.set_image_to_process(img)
+        peak = max(peak, rss_mb())
+    duration = time.perf_counter() - t_start
+
+    fobj.stop()
+    tello.stop_video()
+
+    cmds = [c for c in tello.get_commands() if c[1].startswith('rc')]
+    stamps = [c[0] for c in cmds]
+    active = [c for c in cmds if c[1] != 'rc 0 0 0 0']
+
+    return {'frames':tello.frame_count,
+            'duration_s':round(duration,3),
+            'commands':len(cmds),
+            'command_rate_hz':round(len(cmds)/duration,3) if duration > 0 else 0.0,
+            'command_interval_ms':latency_stats(np.diff(stamps) if len(stamps) > 1 else []),
+            'tracking_ratio':round(len(active)/max(1,len(cmds)),3),
+            'peak_rss_mb':round(peak,1)}
+
+
+# metrics checked against the baseline, True if higher is better
+CHECKED = {('fps',):True,
+           ('latency_ms','p90'):False,
+           ('peak_rss_mb',):False,
+           ('command_rate_hz',):True,
+           ('command_interval_ms','p90'):False}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare results with a stored baseline
+
+    Args:
+        results (dict): name -> result dictionary
+        baseline (dict): same layout, previously saved
+        tolerance (float, optional): allowed relative change. Defaults to 0.1.
+
+    Returns:
+        list: regression messages, empty if no regression. Baseline entries / metrics missing from the results are regressions.
+    """
+    regressions = []
+
+    # a skipped model or clip must not pass
+    for name in baseline:
+        if name not in results:
+            regressions.append("{}: missing, in baseline but not measured".format(name))
+
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+
+        for keys, higher in CHECKED.items():
+            cur, ref = res, baseline[name]
+            for k in keys:
+                cur = cur.get(k) if isinstance(cur, dict) else None
+                ref = ref.get(k) if isinstance(ref, dict) else None
+            if ref is None or ref == 0:
+                continue
+            if cur is None:
+                regressions.append("{}: {} missing, baseline {}".format(name, '.'.join(keys), ref))
+                continue
+
+            if higher and cur < ref*(1.0-tolerance):
+                regressions.append("{}: {} {} < {} (baseline)".format(name, '.'.join(keys), cur, ref))
+            if not higher and cur > ref*(1.0+tolerance):
+                regressions.append("{}: {} {} > {} (baseline)".format(name, '.'.join(keys), cur, ref))
+
+    return regressions
+
+
+def load_baseline(path):
+    """Load a JSON baseline
+
+    Args:
+        path (str): file name
+
+    Returns:
+        dict: baseline results
+
+    Raises:
+        FileNotFoundError: missing baseline, nothing to compare with
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    """Store results as JSON baseline
+
+    Args:
+        path (str): file name
+        results (dict): name -> result dictionary
+    """
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -1,4 +1,5 @@
 import cv2
+import time
 import numpy as np
 
 class DnnObjectDetect():
@@ -23,6 +24,9 @@ class DnnObjectDetect():
         self.type = DETECT
         self.confidence = CONFIDENCE
 
+        # duration of the last detection stages [s], see detect()
+        self.stage_times = {'preprocess':0.0, 'inference':0.0, 'postprocess':0.0}
+
     def detect(self,img, size=(300,300)):
         """
         Detect the face
@@ -36,10 +40,15 @@ class DnnObjectDetect():
         detections = []
         tp =[]
         h,w = img.shape[:2]
+
+        t0 = time.perf_counter()
         blob = cv2.dnn.blobFromImage(cv2.resize(img,size))
         self.network.setInput(blob)
 
+        t1 = time.perf_counter()
         det = self.network.forward()
+
+        t2 = time.perf_counter()
         for d in det:
             conf = d[0,0,2]
 
@@ -74,8 +83,22 @@ class DnnObjectDetect():
                     detections.append(bbox)
                     tp = [detections[0][0] + detections[0][2]//2, detections[0][1] + detections[0][3]//2, detections[0][3]]
 
+        t3 = time.perf_counter()
+        self.stage_times['preprocess'] = t1 - t0
+        self.stage_times['inference'] = t2 - t1
+        self.stage_times['postprocess'] = t3 - t2
+
         return tp, detections
 
+    def warmup(self, image_size=(640,480), size=(300,300)):
+        """
+        Run a detection on an empty image, first inference allocates the network buffers
+        Args:
+            image_size (tuple, optional): size of the processed images. Defaults to (640,480).
+            size (tuple, optional): network input size. Defaults to (300,300).
+        """
+        self.detect(np.zeros((image_size[1],image_size[0],3),np.uint8), size=size)
+
     def draw_detections(self,det,img,COLOR=[0,255,0]):
         """
         Draw detections
@@ -0,0 +1,153 @@
+import time
+import threading
+import numpy as np
+
+
+class EgoMotion():
+    """
+    Predicts the image motion caused by the drone itself (yaw, climb, lateral move),
+    from the tello state stream and the last rc command. Pose history is kept at telemetry rate,
+    the image shift between two timestamps is a linear projection of the pose change.
+    """
+
+    def __init__(self, IMAGE_SIZE=(640,480), HFOV=70.0, DISTANCE=150.0, RC_GAIN=(1.0,1.0,1.0), VSCALE=10.0, HISTORY=256) -> None:
+        """
+        Args:
+            IMAGE_SIZE (tuple, optional): processed image size. Defaults to (640,480).
+            HFOV (float, optional): horizontal field of view of the camera [deg]. Defaults to 70.0.
+            DISTANCE (float, optional): assumed target distance [cm]. Defaults to 150.0.
+            RC_GAIN (tuple, optional): rc value -> rate of [yaw deg/s, height cm/s, lateral cm/s]. Defaults to (1.0,1.0,1.0).
+            VSCALE (float, optional): state velocity unit -> cm/s. Defaults to 10.0 (dm/s).
+            HISTORY (int, optional): pose samples kept. Defaults to 256.
+        """
+        self.rc_gain = np.asarray(RC_GAIN, dtype=np.float64)
+        self.vscale = VSCALE
+        self.history = HISTORY
+        self.set_camera(IMAGE_SIZE, HFOV, DISTANCE)
+
+        # pose history rows: [t, yaw (unwrapped) deg, height cm, lateral cm]
+        self.hist = np.zeros((HISTORY,4))
+        self.n = 0
+        self.lock = threading.Lock()
+
+        # last raw yaw, for unwrapping
+        self.yaw_raw = None
+
+        # last rc command rates [yaw, height, lateral], extrapolation after the last state packet
+        self.rates = np.zeros(3)
+        self.t_cmd = 0.0
+        self.max_extrap = 0.5
+        self.cmd_timeout = 0.5
+
+    def set_camera(self, IMAGE_SIZE=(640,480), HFOV=70.0, DISTANCE=150.0):
+        """
+        Set the projection, pose change [yaw, height, lateral] -> image shift [dx, dy]
+        Args:
+            IMAGE_SIZE (tuple, optional): processed image size. Defaults to (640,480).
+            HFOV (float, optional): horizontal field of view [deg]. Defaults to 70.0.
+            DISTANCE (float, optional): assumed target distance [cm]. Defaults to 150.0.
+        """
+        f = (IMAGE_SIZE[0]/2.0)/np.tan(np.radians(HFOV)/2.0)
+
+        # turning cw or moving right shifts the scene left, climbing shifts it down
+        self.J = np.array([[-f*np.pi/180.0, 0.0, -f/DISTANCE],
+                           [0.0, f/DISTANCE, 0.0]])
+
+    def update(self, state, t=None):
+        """
+        Add a tello state packet, called at telemetry rate
+        Args:
+            state (list): TelloConnect.state_value, [key, value, key, value, ...]
+            t (float, optional): time.perf_counter() of the packet. Defaults to now.
+        """
+        if t is None: t = time.perf_counter()
+        try:
+            val = dict(zip(state[0::2], state[1::2]))
+            yaw = float(val['yaw'])
+            h = float(val['h'])
+            vgy = float(val['vgy'])*self.vscale
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+            # unwrap yaw
+            if self.yaw_raw is None or self.n == 0:
+                yaw_u = yaw
+                lat = 0.0
+            else:
+                last = self.hist[self.n-1]
+                yaw_u = last[1] + (yaw - self.yaw_raw + 180.0) % 360.0 - 180.0
+                lat = last[3] + vgy*max(0.0, t - last[0])
+            self.yaw_raw = yaw
+
+            # keep the newest half when full
+            if self.n == self.history:
+                half = self.history//2
+                self.hist[:half] = self.hist[half:]
+                self.n = half
+
+            self.hist[self.n] = (t, yaw_u, h, lat)
+            self.n += 1
+
+    def command(self, rc, t=None):
+        """
+        Register the rc command just sent
+        Args:
+            rc (tuple): (leftright, fwdbackw, updown, yaw)
+            t (float, optional): time.perf_counter() of the command. Defaults to now.
+        """
+        self.rates = self.rc_gain*np.array([rc[3], rc[2], rc[0]], dtype=np.float64)
+        self.t_cmd = time.perf_counter() if t is None else t
+
+    def pose(self, t):
+        """
+        Pose at time t, interpolated from the history, extrapolated with the last command after the last packet
+        Args:
+            t (float): time.perf_counter()
+
+        Returns:
+            array: [yaw deg, height cm, lateral cm]
+        """
+        with self.lock:
+            if self.n == 0:
+                return np.zeros(3)
+            hist = self.hist[:self.n]
+
+            i = int(np.searchsorted(hist[:,0], t))
+            if i == 0:
+                return hist[0,1:].copy()
+            if i < self.n:
+                w = (t - hist[i-1,0])/max(1e-9, hist[i,0] - hist[i-1,0])
+                return hist[i-1,1:]*(1.0-w) + hist[i,1:]*w
+
+            last = hist[-1].copy()
+
+        # commanded motion since the last packet
+        if t - self.t_cmd > self.cmd_timeout:
+            return last[1:]
+        return last[1:] + self.rates*min(t - last[0], self.max_extrap)
+
+    def shift(self, t0, t1):
+        """
+        Image motion of a static target caused by the drone between t0 and t1
+        Args:
+            t0 (float): time.perf_counter()
+            t1 (float): time.perf_counter()
+
+        Returns:
+            array: [dx, dy] pixels
+        """
+        return self.shift_since(self.pose(t0), t1)
+
+    def shift_since(self, pose0, t):
+        """
+        Image motion of a static target caused by the drone since the reference pose.
+        Use for long intervals, the pose at an old timestamp may be out of the history.
+        Args:
+            pose0 (array): reference pose, see pose()
+            t (float): time.perf_counter()
+
+        Returns:
+            array: [dx, dy] pixels
+        """
+        return self.J @ (self.pose(t) - pose0)
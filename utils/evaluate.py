@@ -0,0 +1,287 @@
+"""
+Offline tracking quality / latency evaluation. A recorded clip is replayed
+through DnnObjectDetect + FollowObject on a simulated clock, optionally
+compared with box annotations.
+
+The centre error and lost tracks are measured on the Kalman target estimate
+(KalmanTracker of FollowObject, extrapolated to the frame time), pnoise / mnoise
+change them. kvscale / khscale / distscale scale the commands only, they change cmd_jitter.
+
+Annotation format, one box per line, coordinates in the clip resolution:
+    <frame index> <x> <y> <w> <h>
+Lines starting with '#' are ignored, frames without a line have no object.
+
+Author: Vilmos Fernengel
+"""
+
+import time
+import itertools
+import multiprocessing
+import cv2
+import numpy as np
+from . import simtello
+from . import followobject
+
+
+# tuned parameters and their FollowObject defaults
+DEFAULTS = {'dconf':0.7, 'cycle_activation':10, 'kvscale':6, 'khscale':4, 'distscale':3, 'pnoise':0.01, 'mnoise':1.0}
+
+# max extrapolation of the target estimate [s], as in the control loop
+HORIZON = 0.3
+
+# ranking keys, True if higher is better
+RANK_KEYS = {'f1':True, 'recall':True, 'precision':True, 'centre_err':False, 'lost_tracks':False,
+             'latency_ms':False, 'det_rate_hz':False, 'cmd_jitter':False}
+
+
+def load_annotations(path):
+    """Load box annotations
+
+    Args:
+        path (str): annotation file
+
+    Returns:
+        dict: frame index -> list of (x,y,w,h)
+    """
+    ann = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            val = line.replace(',',' ').split()
+            ann.setdefault(int(val[0]), []).append(tuple(float(v) for v in val[1:5]))
+
+    return ann
+
+
+def iou(a, b):
+    """Intersection over union of two (x,y,w,h) boxes
+    """
+    x0, y0 = max(a[0],b[0]), max(a[1],b[1])
+    x1, y1 = min(a[0]+a[2],b[0]+b[2]), min(a[1]+a[3],b[1]+b[3])
+    inter = max(0.0, x1-x0) * max(0.0, y1-y0)
+    union = a[2]*a[3] + b[2]*b[3] - inter
+
+    return inter/union if union > 0 else 0.0
+
+
+def match(det, gt, thr=0.5):
+    """Greedy matching of detections to annotations
+
+    Returns:
+        int: true positives
+    """
+    tp = 0
+    used = set()
+    for d in det:
+        best, bi = thr, None
+        for i,g in enumerate(gt):
+            if i in used:
+                continue
+            v = iou(d, g)
+            if v >= best:
+                best, bi = v, i
+        if bi is not None:
+            used.add(bi)
+            tp += 1
+
+    return tp
+
+
+def evaluate(params, clip, model, proto, detect='Face', annotations=None, image_size=(640,480), maxframes=0):
+    """Replay a clip with the given parameters
+
+    The FollowObject worker is simulated: it ticks every 5 ms, runs a detection every
+    cycle_activation ticks on the newest frame, the measured inference time advances the clock.
+
+    Args:
+        params (dict): parameters, see DEFAULTS
+        clip (str): video file
+        model (str): DNN model
+        proto (str): prototxt
+        detect (str, optional): ['Face', 'Person']. Defaults to 'Face'.
+        annotations (dict, optional): see load_annotations(). Defaults to None.
+        image_size (tuple, optional): processed frame size. Defaults to (640,480).
+        maxframes (int, optional): frames to replay, 0 - full clip. Defaults to 0.
+
+    Returns:
+        dict: parameters and metrics
+    """
+    p = dict(DEFAULTS)
+    p.update(params)
+
+    tello = simtello.SimTello(VIDEO_SOURCE=clip, IMAGE_SIZE=image_size, REALTIME=False, MAXFRAMES=maxframes)
+    sx = image_size[0] / max(1.0, tello.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    sy = image_size[1] / max(1.0, tello.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    fobj = followobject.FollowObject(tello, MODEL=model, PROTO=proto, CONFIDENCE=p['dconf'], DETECT=detect, START=False)
+    fobj.set_detection_periodicity(int(p['cycle_activation']))
+    fobj.set_kalman_noise(p['pnoise'], p['mnoise'])
+    fobj.kvscale, fobj.khscale, fobj.distscale = p['kvscale'], p['khscale'], p['distscale']
+
+    tick = 0.005
+    frame_t = 1.0/tello.fps
+
+    # target estimate of the control loop, noise set by set_kalman_noise()
+    tracker = fobj.tracker
+
+    # simulated worker clock, tracker belief: estimated target point or None
+    t = 0.0
+    cycle = 1
+    belief = None
+    inference = 0.0
+    latencies = []
+    cmds = []
+    centre_err = []
+    lost = 0
+    tp_sum = fp_sum = fn_sum = 0
+    detections = 0
+
+    idx = 0
+    img = tello.get_frame()
+    while img is not None:
+        t_frame = idx*frame_t
+
+        # run the worker ticks till the next frame arrives
+        while t < t_frame + frame_t:
+            t += tick
+            if t >= t_frame and cycle % fobj.cycle_activation == 0:
+                t0 = time.perf_counter()
+                cmd = fobj.process(img)
+                d = time.perf_counter() - t0
+                t += d
+                inference += d
+                detections += 1
+
+                latencies.append(t - t_frame)
+                cmds.append(cmd)
+
+                tracker.update({'t':t_frame, 'tp':fobj.tp, 'det':fobj.det if fobj.det is not None else []})
+
+                if annotations is not None:
+                    gt = [(g[0]*sx, g[1]*sy, g[2]*sx, g[3]*sy) for g in annotations.get(idx, [])]
+                    det = fobj.det if fobj.det is not None else []
+                    m = match(det, gt)
+                    tp_sum += m
+                    fp_sum += len(det) - m
+                    fn_sum += len(gt) - m
+            cycle += 1
+
+        # tracker belief on this frame: estimate extrapolated to the frame time, dropped after the tracker timeout
+        target = tracker.target
+        if target is not None and t_frame - target[0] <= tracker.timeout:
+            x,y = target[1][:2] + target[1][3:5]*min(t_frame - target[0], HORIZON)
+            belief = (x, y)
+        else:
+            if belief is not None: lost += 1
+            belief = None
+
+        # centre error of the tracker belief on this frame
+        if annotations is not None:
+            gt = annotations.get(idx, [])
+            if len(gt) > 0 and belief is not None:
+                g = gt[0]
+                centre_err.append(np.hypot((g[0]+g[2]/2)*sx - belief[0], (g[1]+g[3]/2)*sy - belief[1]))
+
+        idx += 1
+        img = tello.get_frame()
+
+    tello.stop_video()
+
+    recall = tp_sum/(tp_sum+fn_sum) if tp_sum+fn_sum > 0 else None
+    precision = tp_sum/(tp_sum+fp_sum) if tp_sum+fp_sum > 0 else None
+    f1 = None
+    if recall is not None and precision is not None and recall+precision > 0:
+        f1 = 2*recall*precision/(recall+precision)
+
+    cmd_arr = np.asarray(cmds, dtype=np.float32).reshape(-1,4)
+    jitter = float(np.abs(np.diff(cmd_arr, axis=0)).mean()) if len(cmd_arr) > 1 else 0.0
+    duration = idx*frame_t
+
+    res = dict(p)
+    res.update({'frames':idx,
+                'recall':None if recall is None else round(recall,3),
+                'precision':None if precision is None else round(precision,3),
+                'f1':None if f1 is None else round(f1,3),
+                'centre_err':round(float(np.mean(centre_err)),2) if len(centre_err) > 0 else None,
+                'centre_err_series':[round(float(v),1) for v in centre_err],
+                'lost_tracks':lost,
+                'latency_ms':round(float(np.mean(latencies))*1000.0,2) if len(latencies) > 0 else None,
+                'det_rate_hz':round(detections/duration,2) if duration > 0 else 0.0,
+                'cpu_s':round(inference,3),
+                'cmd_jitter':round(jitter,2)})
+
+    return res
+
+
+def grid(values):
+    """Expand a parameter grid
+
+    Args:
+        values (dict): parameter -> list of values
+
+    Returns:
+        list: parameter dictionaries
+    """
+    keys = list(values.keys())
+    return [dict(zip(keys,v)) for v in itertools.product(*[values[k] for k in keys])]
+
+
+def _evaluate(job):
+    # one OpenCV thread per process, the sweep is parallel over processes
+    cv2.setNumThreads(1)
+    params, kwargs = job
+    return evaluate(params, **kwargs)
+
+
+def sweep(values, processes=None, **kwargs):
+    """Evaluate a parameter grid in parallel
+
+    Args:
+        values (dict): parameter -> list of values
+        processes (int, optional): worker processes, None - all cores. Defaults to None.
+        kwargs: see evaluate()
+
+    Returns:
+        list: evaluate() results
+    """
+    jobs = [(p, kwargs) for p in grid(values)]
+
+    with multiprocessing.Pool(processes=processes) as pool:
+        return pool.map(_evaluate, jobs)
+
+
+def rank(results, key='f1'):
+    """Sort the results, best first, missing values last
+
+    Args:
+        results (list): evaluate() results
+        key (str, optional): see RANK_KEYS. Defaults to 'f1'.
+
+    Returns:
+        list: sorted results
+    """
+    higher = RANK_KEYS[key]
+    valid = [r for r in results if r.get(key) is not None]
+    missing = [r for r in results if r.get(key) is None]
+
+    return sorted(valid, key=lambda r: r[key], reverse=higher) + missing
+
+
+def table(results, columns=None):
+    """Format the results as text table
+
+    Returns:
+        str: table
+    """
+    if columns is None:
+        columns = list(DEFAULTS.keys()) + ['f1','recall','precision','centre_err','lost_tracks','latency_ms','det_rate_hz','cpu_s','cmd_jitter']
+
+    rows = [['#'] + columns]
+    for i,r in enumerate(results):
+        rows.append([str(i+1)] + ['-' if r.get(c) is None else str(r.get(c)) for c in columns])
+
+    width = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+
+    return '\n'.join(' '.join(v.rjust(w) for v,w in zip(row,width)) for row in rows)
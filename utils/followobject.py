@@ -1,8 +1,9 @@
 import cv2
+import time
 import threading
-import numpy as np
 from . import safethread
 from . import kalman
+from . import stages
 from . import dnnobjectdetect
 
 
@@ -12,10 +13,12 @@ class FollowObject():
     Horizontal / vertical / FW/BackW / yaw are controlled, using Kalman filters.
     """
 
-    def __init__(self, tello, MODEL='',PROTO='', CONFIDENCE=0.8, DETECT='Face', DEBUG=False) -> None:
+    def __init__(self, tello, MODEL='',PROTO='', CONFIDENCE=0.8, DETECT='Face', DEBUG=False, START=True, DETECTOR=None, CONTROL_RATE=0) -> None:
         
-        # face detector
-        if MODEL !='' and PROTO!='':
+        # face detector, use the preloaded one if available
+        if DETECTOR is not None:
+            self.dnnfacedetect = DETECTOR
+        elif MODEL !='' and PROTO!='':
             self.dnnfacedetect = dnnobjectdetect.DnnObjectDetect(MODEL,PROTO, CONFIDENCE=CONFIDENCE, DETECT=DETECT)
         else:
             self.dnnfacedetect = dnnobjectdetect.DnnObjectDetect(CONFIDENCE=CONFIDENCE,DETECT=DETECT)
@@ -60,8 +63,47 @@ class FollowObject():
         self.kvscale = 6
         self.khscale = 4
         self.distscale = 3
+        self.kalman_noise = (0.01, 1.0)
 
-        self.wt = safethread.SafeThread(target=self.__worker).start()
+        # fixed rate control loop [Hz], 0 - commands are sent right after the detection
+        self.control_rate = CONTROL_RATE
+        self.control_ev = threading.Event()
+        self.t_next = None
+
+        # control loop, same stages as the pipeline (utils/stages.py); 'ego' - EgoMotion, see set_ego_motion()
+        self.context = {'tello':tello, 'ego':None}
+        self.tracker = stages.KalmanTracker(self.context, *self.kalman_noise)
+
+        # P gains match the scale factors of the detection driven control
+        self.controller = stages.PIDController(self.context, KP=(1.0/self.kvscale, 1.0/self.distscale, 1.0/self.khscale, 1.0/self.kvscale),
+                                               LIMIT=40, SETPOINT=self.dist_setpoint, HORIZONTAL=False)
+
+        # shape of the last processed image
+        self.shape = None
+
+        # capture time of the image to process
+        self.t_img = None
+
+        # START=False leaves the worker stopped, frames can be processed with process()
+        self.wt = safethread.SafeThread(target=self.__worker)
+        self.ct = safethread.SafeThread(target=self.__control)
+        if START:
+            self.wt.start()
+            if self.control_rate > 0: self.ct.start()
+
+    def start(self):
+        """
+        Start the worker and control threads, if created with START=False
+        """
+        if self.wt.is_alive() is not True: self.wt.start()
+        if self.control_rate > 0 and self.ct.is_alive() is not True: self.ct.start()
+
+    def stop(self):
+        """
+        Stop the worker and control threads
+        """
+        self.wt.stop()
+        self.ct.stop()
     
     def set_default_distance(self,DISTANCE=100):
         """
@@ -71,6 +113,7 @@ class FollowObject():
             DISTANCE (int, optional): [description]. Defaults to 100.
         """
         self.dist_setpoint = DISTANCE
+        self.controller.setpoint = DISTANCE
     
     def set_default_area(self,DISTANCE=13):
         """
@@ -96,6 +139,8 @@ class FollowObject():
         self.use_distance_tracking = DISTANCE
         self.use_rotation_tracking = ROTATION
 
+        self.controller.set_tracking(HORIZONTAL, VERTICAL, DISTANCE, ROTATION)
+
 
     def set_image_to_process(self, img):
         """Image to process
@@ -104,7 +149,18 @@ class FollowObject():
             img (nxmx3): RGB image
         """
         self.img = img
+        self.t_img = time.perf_counter()
     
+    def set_ego_motion(self, EGO=None):
+        """
+        Compensate the image motion caused by the drone itself
+        Args:
+            EGO (EgoMotion, optional): fed with the tello state stream, None - disabled. Defaults to None.
+        """
+        # estimators restart in the new frame
+        self.tracker.reset()
+        self.context['ego'] = EGO
+
     def set_detection_periodicity(self,PERIOD=10):
         """
         Sets detection periodicity.
@@ -113,6 +169,28 @@ class FollowObject():
         """
         self.cycle_activation = PERIOD
 
+    def set_kalman_noise(self, PROCESS=0.01, MEASUREMENT=1.0):
+        """
+        Sets the noise of the Kalman estimators
+        Args:
+            PROCESS (float, optional): process noise. Defaults to 0.01.
+            MEASUREMENT (float, optional): measurement noise. Defaults to 1.0.
+        """
+        self.kalman_noise = (PROCESS, MEASUREMENT)
+        self.tracker.noise = self.kalman_noise
+        self.kf.set_noise(PROCESS, MEASUREMENT)
+        self.kfarea.set_noise(PROCESS, MEASUREMENT)
+
+    def set_pid(self, KP=None, KI=None, KD=None):
+        """
+        Sets the control loop gains, per axis [leftright, fwdbackw, updown, yaw], None keeps the current value
+        Args:
+            KP (tuple, optional): proportional gains. Defaults to None.
+            KI (tuple, optional): integral gains. Defaults to None.
+            KD (tuple, optional): derivative gains. Defaults to None.
+        """
+        self.controller.pid.set_gains(KP, KI, KD)
+
     def safety_limiter(self,leftright,fwdbackw,updown,yaw, SAFETYLIMIT=30):
         """
         Implement a safety limiter if values exceed defined threshold
@@ -123,15 +201,35 @@ class FollowObject():
             updown ([type]): control value up down
             yaw ([type]): control value rotation
         """
-        val = np.array([leftright,fwdbackw,updown,yaw])
-
         # test uppler lover levels
-        val[val>=SAFETYLIMIT] = SAFETYLIMIT
-        val[val<=-SAFETYLIMIT] = -SAFETYLIMIT
+        return tuple(max(-SAFETYLIMIT, min(SAFETYLIMIT, v)) for v in (leftright,fwdbackw,updown,yaw))
 
-        return val[0],val[1],val[2],val[3]
+    def __send(self,leftright,fwdbackw,updown,yaw):
+        """
+        Single channel of the tello rc commands
+        """
+        cmd = "rc {leftright} {fwdbackw} {updown} {yaw}".format(leftright=int(round(leftright)),fwdbackw=int(round(fwdbackw)),updown=int(round(updown)),yaw=int(round(yaw)))
+        self.tello.send_cmd(cmd)
 
+        ego = self.context['ego']
+        if ego is not None: ego.command((leftright,fwdbackw,updown,yaw))
 
+        if self.debug:
+           print (cmd, str(self.cycle_counter))
+
+    def __control(self):
+        """Control thread, commands tello at fixed rate from the latest target estimate
+        """
+        period = 1.0/self.control_rate
+
+        # keep the rate, without drift
+        now = time.perf_counter()
+        if self.t_next is None or now - self.t_next > period: self.t_next = now
+        if self.t_next > now: self.control_ev.wait(self.t_next - now)
+        self.t_next += period
+
+        item = {'target':self.tracker.target, 'pose_ref':self.tracker.pose_ref, 'shape':self.shape}
+        self.__send(*self.controller.control(item))
 
     def __worker(self):
         """Worker thread to process command / detections
@@ -143,76 +241,100 @@ class FollowObject():
         # process image, command tello
         if self.img is not None and self.cycle_counter % self.cycle_activation == 0:
 
-            dist = 0
-            vy = 0
-            vx,rx = 0,0
             # work on a local copy
-            img = self.img.copy()
-
-            # detect face
-            tp,det = self.dnnfacedetect.detect(img)
-
-            if  len(det) > 0:
-                self.det = det
-                self.tp = tp
-                
-                # init estimators
-                if self.track == False:
-                    h,w = img.shape[:2]
-                    self.cx = w//2
-                    self.cy = h//2
-                    self.kf.init(self.cx,self.cy)
-
-                    # compute init 'area', ignor x dimension
-                    self.kfarea.init(1,tp[1])
-                    self.track = True
-
-                # process corrections, compute delta between two objects
-                _,cp = self.kf.predictAndUpdate(self.cx,self.cy,True)
-
-                # calculate delta over 2 axis
-                mvx = -int((cp[0]-tp[0])//self.kvscale)
-                mvy = int((cp[1]-tp[1])//self.khscale)
-
-                if self.use_distance_tracking:
-                    # use detection y value to estimate object distance
-                    obj_y = tp[2]
-
-                    _, ocp = self.kfarea.predictAndUpdate(1, obj_y, True)
-
-                    dist = int((ocp[1]-self.dist_setpoint)//self.distscale)
-
-                # Fill out variables to be sent in the tello command
-                # don't combine horizontal and rotation
-                if self.use_horizontal_tracking:
-                    rx = 0
-                    vx = mvx
-                if self.use_rotation_tracking:
-                    vx = 0
-                    rx = mvx
-
-                if self.use_vertical_tracking:
-                    vy = mvy
-
-                # limit signals if is the case, could save your tello
-                vx,dist,vy,rx = self.safety_limiter(vx,dist,vy,rx,SAFETYLIMIT=40)
-
-                cmd = "rc {leftright} {fwdbackw} {updown} {yaw}".format(leftright=vx,fwdbackw=-dist,updown=vy,yaw=rx)
-                self.tello.send_cmd(cmd)
-                
-                if self.debug:
-                   print (cmd, str(self.cycle_counter))
-
-            else:
-                # no detection, keep position
-                cmd = "rc {leftright} {fwdbackw} {updown} {yaw}".format(leftright=0,fwdbackw=0,updown=0,yaw=0)
-                self.tello.send_cmd(cmd)
-                self.det = None
-                
+            self.process(self.img.copy(), self.t_img)
+
         self.cycle_counter +=1
 
+    def process(self, img, T=None):
+        """Detect the object, command tello
+
+        Args:
+            img (nxmx3): RGB image
+            T (float, optional): time.perf_counter() of the image capture, None - now. Defaults to None.
+
+        Returns:
+            tuple: (leftright, fwdbackw, updown, yaw) values sent to tello, None if the control loop sends the commands
+        """
+
+        dist = 0
+        vy = 0
+        vx,rx = 0,0
+
+        t_img = time.perf_counter() if T is None else T
+
+        # detect face
+        tp,det = self.dnnfacedetect.detect(img)
+
+        # control loop mode, just update the target estimate
+        if self.control_rate > 0:
+            self.det = det if len(det) > 0 else None
+            if len(det) > 0: self.tp = tp
+            self.shape = img.shape
+            self.tracker.update({'t':t_img, 'tp':tp, 'det':det, 'shape':img.shape})
+            return None
+
+        if  len(det) > 0:
+            self.det = det
+            self.tp = tp
+            
+            # init estimators
+            if self.track == False:
+                h,w = img.shape[:2]
+                self.cx = w//2
+                self.cy = h//2
+                self.kf.init(self.cx,self.cy)
+
+                # compute init 'area', ignor x dimension
+                self.kfarea.init(1,tp[1])
+                self.track = True
+
+            # process corrections, compute delta between two objects
+            _,cp = self.kf.predictAndUpdate(self.cx,self.cy,True)
+
+            # target position now: add the drone motion since the image capture
+            tx,ty = tp[0],tp[1]
+            ego = self.context['ego']
+            if ego is not None:
+                dx,dy = ego.shift(t_img, time.perf_counter())
+                tx,ty = tx+dx, ty+dy
+
+            # calculate delta over 2 axis
+            mvx = -int((cp[0]-tx)//self.kvscale)
+            mvy = int((cp[1]-ty)//self.khscale)
+
+            if self.use_distance_tracking:
+                # use detection y value to estimate object distance
+                obj_y = tp[2]
+
+                _, ocp = self.kfarea.predictAndUpdate(1, obj_y, True)
+
+                dist = int((ocp[1]-self.dist_setpoint)//self.distscale)
+
+            # Fill out variables to be sent in the tello command
+            # don't combine horizontal and rotation
+            if self.use_horizontal_tracking:
+                rx = 0
+                vx = mvx
+            if self.use_rotation_tracking:
+                vx = 0
+                rx = mvx
+
+            if self.use_vertical_tracking:
+                vy = mvy
+
+            # limit signals if is the case, could save your tello
+            vx,dist,vy,rx = self.safety_limiter(vx,dist,vy,rx,SAFETYLIMIT=40)
+
+            self.__send(vx,-dist,vy,rx)
+
+        else:
+            # no detection, keep position
+            self.__send(0,0,0,0)
+            self.det = None
+
+        return vx,-dist,vy,rx
 
-                 
     def draw_detections(self,img, HUD=True, ANONIMUS=False):
         """Draw detections on an image
 
@@ -237,6 +359,10 @@ class FollowObject():
                 cv2.putText(img,str('Baro') + ": " + str(hud[23]),(w//2+100,40),typef,sizef,color,sizeb)
                 cv2.putText(img,str('Acceleration') + ": " + 'agx'+ " "+ str(hud[-6]) + ' agy'+ " "+ str(hud[-4]) + ' agz'+ " "+ str(hud[-2]),(30,h-30),typef,sizef,color,sizeb)
 
+                if getattr(self.tello, 'low_latency', False):
+                    vs = self.tello.get_video_stats()
+                    cv2.putText(img,'Video: decode {:.1f} ms, age {:.1f} ms, drops {}, reconnects {}'.format(vs['decode_ms'],vs['age_ms'],vs['drops'],vs['reconnects']),(30,h-50),typef,sizef,color,sizeb)
+
                 for ev in self.tello.eventlist:
                     ret = ev['cmd']
                     if ret is not None and ret == 'wifi?':
@@ -0,0 +1,201 @@
+"""
+Named shared memory ring of video frames. One writer (TelloConnect) publishes
+the decoded frames, any number of processes attach read-only by name.
+
+Layout: header | slot metadata (seq, timestamp, height, width, channels) | frame slots
+A slot is marked with seq 0 while written, readers check the seq after use (seqlock).
+
+Author: Vilmos Fernengel
+"""
+
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = 0x54454c4c4f524e47
+
+# header fields, uint64
+H_MAGIC, H_SLOTS, H_HEIGHT, H_WIDTH, H_CHANNELS, H_SEQ = range(6)
+HEADER_SIZE = 64
+
+META = np.dtype([('seq','<u8'), ('timestamp','<f8'), ('height','<u4'), ('width','<u4'), ('channels','<u4'), ('pad','<u4')])
+
+
+def _views(buf, slots=None, shape=None):
+    """Numpy views of header, metadata and frame slots over the shared buffer
+    """
+    header = np.ndarray((8,), dtype='<u8', buffer=buf, offset=0)
+    if slots is None:
+        slots = int(header[H_SLOTS])
+        shape = (int(header[H_HEIGHT]), int(header[H_WIDTH]), int(header[H_CHANNELS]))
+
+    meta = np.ndarray((slots,), dtype=META, buffer=buf, offset=HEADER_SIZE)
+
+    # frame data aligned to 64 bytes
+    offset = (HEADER_SIZE + slots*META.itemsize + 63)//64*64
+    data = np.ndarray((slots,) + tuple(shape), dtype=np.uint8, buffer=buf, offset=offset)
+
+    return header, meta, data
+
+
+def _size(slots, shape):
+    return (HEADER_SIZE + slots*META.itemsize + 63)//64*64 + slots*int(np.prod(shape))
+
+
+class FrameRingWriter():
+    """
+    Creates the ring, publishes frames
+    """
+
+    def __init__(self, NAME, SHAPE=(480,640,3), SLOTS=4):
+        """
+        Args:
+            NAME (str): shared memory name
+            SHAPE (tuple, optional): max frame shape (h,w,c). Defaults to (480,640,3).
+            SLOTS (int, optional): frames kept in the ring. Defaults to 4.
+        """
+        self.name = NAME
+        self.shape = tuple(SHAPE)
+        self.slots = SLOTS
+
+        self.shm = shared_memory.SharedMemory(name=NAME, create=True, size=_size(SLOTS, self.shape))
+        self.header, self.meta, self.data = _views(self.shm.buf, SLOTS, self.shape)
+
+        self.meta[:] = 0
+        self.header[:] = 0
+        self.header[H_SLOTS] = SLOTS
+        self.header[H_HEIGHT], self.header[H_WIDTH], self.header[H_CHANNELS] = self.shape
+        self.header[H_MAGIC] = MAGIC
+
+    def publish(self, frame, timestamp=None):
+        """Copy a frame into the next slot
+
+        Args:
+            frame (hxwxc uint8): frame, must fit in the slot
+            timestamp (float, optional): time.time() if None
+
+        Returns:
+            int: sequence number of the frame
+        """
+        h, w = frame.shape[:2]
+        c = frame.shape[2] if frame.ndim == 3 else 1
+        if h > self.shape[0] or w > self.shape[1] or c != self.shape[2]:
+            raise ValueError("frame {} does not fit the ring {}".format(frame.shape, self.shape))
+
+        seq = int(self.header[H_SEQ]) + 1
+        i = seq % self.slots
+        m = self.meta[i]
+
+        # mark slot as written
+        m['seq'] = 0
+        self.data[i, :h, :w] = frame.reshape(h, w, c)
+        m['timestamp'] = time.time() if timestamp is None else timestamp
+        m['height'], m['width'], m['channels'] = h, w, c
+        m['seq'] = seq
+
+        self.header[H_SEQ] = seq
+
+        return seq
+
+    def close(self):
+        """Release and remove the shared memory
+        """
+        del self.header, self.meta, self.data
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FrameRingReader():
+    """
+    Attaches read-only to an existing ring, frames are returned as views, without copy
+    """
+
+    def __init__(self, NAME):
+        """
+        Args:
+            NAME (str): shared memory name
+        """
+        self.name = NAME
+
+        # the writer owns the memory, do not let the resource tracker unlink it at exit
+        try:
+            self.shm = shared_memory.SharedMemory(name=NAME, track=False)
+        except TypeError:
+            self.shm = shared_memory.SharedMemory(name=NAME)
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            except Exception:
+                pass
+
+        self.header, self.meta, self.data = _views(self.shm.buf)
+        if int(self.header[H_MAGIC]) != MAGIC:
+            raise ValueError("{} is not a frame ring".format(NAME))
+
+        for v in (self.header, self.meta, self.data):
+            v.flags.writeable = False
+
+        self.slots = int(self.header[H_SLOTS])
+        self.last_seq = 0
+
+    def latest_seq(self):
+        """
+        Returns:
+            int: sequence number of the newest frame, 0 if nothing published yet
+        """
+        return int(self.header[H_SEQ])
+
+    def get(self, seq=None):
+        """Frame view and metadata
+
+        Args:
+            seq (int, optional): sequence number, None - newest. Defaults to None.
+
+        Returns:
+            (dict, array): metadata (seq, timestamp, height, width, channels), frame view; (None, None) if not available
+        """
+        if seq is None: seq = self.latest_seq()
+        if seq == 0:
+            return None, None
+
+        m = self.meta[seq % self.slots]
+        if int(m['seq']) != seq:
+            return None, None
+
+        meta = {'seq':seq, 'timestamp':float(m['timestamp']), 'height':int(m['height']), 'width':int(m['width']), 'channels':int(m['channels'])}
+        frame = self.data[seq % self.slots, :meta['height'], :meta['width']]
+        self.last_seq = seq
+
+        return meta, frame
+
+    def valid(self, meta):
+        """Check if the frame was not overwritten since get(), call after using the view
+
+        Returns:
+            bool: True if the view still holds the frame of meta
+        """
+        return meta is not None and int(self.meta[meta['seq'] % self.slots]['seq']) == meta['seq']
+
+    def wait(self, timeout=1.0, poll=0.001):
+        """Wait for a frame newer than the last one returned by get()
+
+        Args:
+            timeout (float, optional): [s]. Defaults to 1.0.
+            poll (float, optional): polling period [s]. Defaults to 0.001.
+
+        Returns:
+            (dict, array): see get(), (None, None) on timeout
+        """
+        t_end = time.perf_counter() + timeout
+        while self.latest_seq() == self.last_seq:
+            if time.perf_counter() > t_end:
+                return None, None
+            time.sleep(poll)
+
+        return self.get()
+
+    def close(self):
+        """Detach, the memory stays available for the others
+        """
+        del self.header, self.meta, self.data
+        self.shm.close()
@@ -43,10 +43,36 @@ class clKalman():
             self.kalman.correct(self.current_measurement)
         self.current_prediction = self.kalman.predict()
 
-        self.current_prediction = [self.current_prediction[0]+self.xi, self.current_prediction[1]+self.yi]
+        self.current_prediction = [float(self.current_prediction[0,0])+self.xi, float(self.current_prediction[1,0])+self.yi]
 
         return self.last_prediction, self.current_prediction
 
+    def correctState(self,x,y):
+        '''
+        Correction with a measurement, then prediction for the next step
+        :param x: first parameter measurement
+        :param y: secound parameter measurement
+        :return: corrected state [x, y, vx, vy], velocities per step
+        '''
+        self.current_measurement = np.array([[np.float32(x-self.xi)], [np.float32(y-self.yi)]])
+        state = self.kalman.correct(self.current_measurement).flatten()
+        self.kalman.predict()
+
+        state[0] += self.xi
+        state[1] += self.yi
+
+        return state
+
+    def set_noise(self, PROCESS=0.01, MEASUREMENT=1.0):
+        '''
+        Set the noise covariances
+        :param PROCESS: process noise, scales the identity matrix
+        :param MEASUREMENT: measurement noise, scales the identity matrix
+        :return:
+        '''
+        self.kalman.processNoiseCov = np.eye(4, dtype=np.float32) * PROCESS
+        self.kalman.measurementNoiseCov = np.eye(2, dtype=np.float32) * MEASUREMENT
+
     def getStateVariables(self):
         '''
         Helper to return internal variables
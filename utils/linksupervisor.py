@@ -0,0 +1,164 @@
+import time
+import threading
+from . import safethread
+
+
+class LinkSupervisor():
+    """
+    Tello link health. Tracks the liveness of the command (acks), state (packets) and video (frames) channels,
+    triggers a failsafe if a channel misses its deadline, recovers with backoff, exposes link metrics.
+    A channel is supervised after its first packet.
+    """
+
+    # failsafe actions
+    ACTIONS = ['none', 'hover', 'land']
+
+    def __init__(self, tello, DEADLINES=None, FAILSAFE=None, PROBE=1.0, PERIOD=0.1, BACKOFF=(0.5, 8.0)) -> None:
+        """
+        Args:
+            tello (TelloConnect): supervised connection
+            DEADLINES (dict, optional): channel -> max silence [s]. Defaults to {'cmd':3.0, 'state':1.0, 'video':1.0}.
+            FAILSAFE (dict, optional): channel -> ['none', 'hover', 'land']. Defaults to {'cmd':'hover', 'state':'hover', 'video':'hover'}.
+            PROBE (float, optional): periodic 'command' probe [s], rc commands are not acknowledged, 0 - disabled. Defaults to 1.0.
+            PERIOD (float, optional): supervision cycle [s]. Defaults to 0.1.
+            BACKOFF (tuple, optional): first and max wait between recovery attempts [s]. Defaults to (0.5, 8.0).
+        """
+        self.tello = tello
+        self.deadlines = {'cmd':3.0, 'state':1.0, 'video':1.0}
+        if DEADLINES is not None: self.deadlines.update(DEADLINES)
+        self.actions = {'cmd':'hover', 'state':'hover', 'video':'hover'}
+        if FAILSAFE is not None: self.actions.update(FAILSAFE)
+        for ch, action in self.actions.items():
+            if action not in self.ACTIONS:
+                raise ValueError("unknown failsafe action {} of channel {}".format(action, ch))
+        self.probe = PROBE
+        self.period = PERIOD
+        self.backoff = BACKOFF
+
+        # probe sent by the periodic command thread, so its answer is not taken for another command's
+        self.probe_ev = None
+
+        # per channel: 'waiting' (no packet yet), 'ok', 'stale'; counters for the metrics
+        self.channels = {}
+        for ch in self.deadlines:
+            self.channels[ch] = {'status':'waiting', 'failsafes':0, 'recoveries':0, 'reconnects':0,
+                                 'backoff':BACKOFF[0], 't_retry':0.0, 't_stale':None, 'outage_s':0.0,
+                                 'count':0, 't_count':time.perf_counter(), 'rate_hz':0.0}
+
+        self.ticker = threading.Event()
+        self.wt = safethread.SafeThread(target=self.__worker)
+
+    def start(self):
+        """
+        Start supervision
+        """
+        if self.probe > 0 and self.probe_ev is None:
+            # scheduler base time of TelloConnect ~ 100 ms
+            self.tello.add_periodic_event('command', max(1, int(round(self.probe/0.1))), 'Link')
+            self.probe_ev = self.tello.eventlist[-1]
+
+        if self.wt.is_alive() is not True: self.wt.start()
+
+    def stop(self):
+        """
+        Stop supervision, release the failsafe
+        """
+        self.wt.stop()
+        self.tello.failsafe = False
+
+        if self.probe_ev is not None:
+            self.tello.eventlist.remove(self.probe_ev)
+            self.probe_ev = None
+
+    def __last(self, ch):
+        """Time of the last packet and packet counter of a channel
+        """
+        if ch == 'cmd': return self.tello.t_ack, self.tello.link_counts['acks']
+        if ch == 'state': return self.tello.t_state, self.tello.link_counts['states']
+        return self.tello.t_last_frame, self.tello.video_stats['frames']
+
+    def __failsafe(self, ch):
+        """Stop the tracker commands, execute the failsafe action of the channel
+        """
+        action = self.actions[ch]
+        if action == 'none':
+            return
+        self.tello.failsafe = True
+        self.channels[ch]['failsafes'] += 1
+        if action == 'hover':
+            self.tello.send_cmd('rc 0 0 0 0', FORCE=True)
+        if action == 'land':
+            self.tello.send_cmd('rc 0 0 0 0', FORCE=True)
+            self.tello.send_cmd('land', FORCE=True)
+
+    def __recover(self, ch, now):
+        """Recovery attempt of a stale channel, exponential backoff
+        """
+        c = self.channels[ch]
+        if now < c['t_retry']:
+            return
+        c['t_retry'] = now + c['backoff']
+        c['backoff'] = min(2*c['backoff'], self.backoff[1])
+        c['reconnects'] += 1
+
+        if ch == 'video':
+            self.tello.request_video_reopen()
+        else:
+            self.tello.rebind_sockets()
+
+    def __worker(self):
+        """Supervision cycle
+        """
+        self.ticker.wait(self.period)
+        now = time.perf_counter()
+
+        for ch, c in self.channels.items():
+            t_last, count = self.__last(ch)
+
+            # packet rate, updated every second
+            if now - c['t_count'] >= 1.0:
+                c['rate_hz'] = (count - c['count'])/(now - c['t_count'])
+                c['count'], c['t_count'] = count, now
+
+            if t_last is None:
+                continue
+
+            if now - t_last > self.deadlines[ch]:
+                if c['status'] != 'stale':
+                    c['status'] = 'stale'
+                    c['t_stale'] = now
+                    self.__failsafe(ch)
+                self.__recover(ch, now)
+            elif c['status'] == 'stale':
+                # recovered
+                c['status'] = 'ok'
+                c['recoveries'] += 1
+                c['outage_s'] += now - c['t_stale']
+                c['backoff'] = self.backoff[0]
+                c['t_retry'] = 0.0
+            else:
+                c['status'] = 'ok'
+
+        # tracker commands allowed again if all channels are alive
+        if self.tello.failsafe and all(c['status'] != 'stale' for c in self.channels.values()):
+            self.tello.failsafe = False
+
+    def get_metrics(self):
+        """Link metrics
+
+        Returns:
+            dict: per channel status, age of the last packet [s], rate [Hz], failsafes, reconnects, recoveries, outage time [s];
+                  swallowed errors and the last error of TelloConnect
+        """
+        now = time.perf_counter()
+        metrics = {}
+        for ch, c in self.channels.items():
+            t_last, _ = self.__last(ch)
+            metrics[ch] = {'status':c['status'], 'age_s':None if t_last is None else round(now - t_last, 3),
+                           'rate_hz':round(c['rate_hz'], 1), 'failsafes':c['failsafes'], 'reconnects':c['reconnects'],
+                           'recoveries':c['recoveries'], 'outage_s':round(c['outage_s'], 2)}
+        metrics['errors'] = dict(self.tello.link_errors)
+        metrics['last_error'] = self.tello.last_error
+        metrics['failsafe'] = self.tello.failsafe
+
+        return metrics
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+class VectorPID():
+    """
+    PID controller for all axes at once (leftright, fwdbackw, updown, yaw).
+    Integral anti-windup, low-pass filtered derivative, per axis gain schedules.
+    """
+
+    def __init__(self, KP=(0.17,0.33,0.25,0.17), KI=(0.0,0.0,0.0,0.0), KD=(0.0,0.0,0.0,0.0), LIMIT=40, ILIMIT=20, TF=0.1):
+        """
+        Args:
+            KP (tuple, optional): proportional gains per axis
+            KI (tuple, optional): integral gains per axis
+            KD (tuple, optional): derivative gains per axis
+            LIMIT (int, optional): output limit, symmetric. Defaults to 40.
+            ILIMIT (int, optional): limit of the integral term output. Defaults to 20.
+            TF (float, optional): derivative filter time constant [s]. Defaults to 0.1.
+        """
+        self.kp = np.asarray(KP, dtype=np.float64)
+        self.ki = np.asarray(KI, dtype=np.float64)
+        self.kd = np.asarray(KD, dtype=np.float64)
+        self.n = len(self.kp)
+
+        self.limit = float(LIMIT)
+        self.ilimit = float(ILIMIT)
+        self.tf = float(TF)
+
+        # gain schedule per axis: (|error| breakpoints, gain scales), None - constant gain
+        self.schedule = [None]*self.n
+
+        # controller state, preallocated
+        self.integral = np.zeros(self.n)
+        self.dfilt = np.zeros(self.n)
+        self.e_prev = np.zeros(self.n)
+        self.scale = np.ones(self.n)
+        self.out = np.zeros(self.n)
+        self.first = True
+
+    def set_gains(self, KP=None, KI=None, KD=None):
+        """
+        Set the gains, None keeps the current value
+        """
+        if KP is not None: self.kp = np.asarray(KP, dtype=np.float64)
+        if KI is not None: self.ki = np.asarray(KI, dtype=np.float64)
+        if KD is not None: self.kd = np.asarray(KD, dtype=np.float64)
+
+    def set_gain_schedule(self, AXIS, ERRORS, SCALES):
+        """
+        Scale the gains of an axis depending on the error magnitude, linear interpolation between breakpoints
+        Args:
+            AXIS (int): 0 - leftright, 1 - fwdbackw, 2 - updown, 3 - yaw
+            ERRORS (list): increasing |error| breakpoints
+            SCALES (list): gain scale at the breakpoints
+        """
+        self.schedule[AXIS] = (np.asarray(ERRORS, dtype=np.float64), np.asarray(SCALES, dtype=np.float64))
+
+    def reset(self):
+        """
+        Clear the controller state
+        """
+        self.integral[:] = 0
+        self.dfilt[:] = 0
+        self.e_prev[:] = 0
+        self.out[:] = 0
+        self.first = True
+
+    def update(self, error, dt):
+        """
+        Compute the control output
+        Args:
+            error (array): error per axis
+            dt (float): time since last update [s]
+
+        Returns:
+            array: control output per axis, limited
+        """
+        e = np.asarray(error, dtype=np.float64)
+        dt = max(dt, 1e-3)
+
+        # gain schedule
+        ae = np.abs(e)
+        for i,s in enumerate(self.schedule):
+            self.scale[i] = 1.0 if s is None else np.interp(ae[i], s[0], s[1])
+
+        # derivative, first order low-pass filtered
+        if self.first:
+            self.e_prev[:] = e
+            self.first = False
+        alpha = self.tf/(self.tf + dt)
+        self.dfilt = alpha*self.dfilt + (1.0-alpha)*(e - self.e_prev)/dt
+        self.e_prev[:] = e
+
+        p = self.scale*self.kp*e
+        d = self.scale*self.kd*self.dfilt
+
+        # anti-windup: integrate only where the output is not saturated in the direction of the error
+        unsat = p + self.ki*self.integral + d
+        grow = (np.abs(unsat) < self.limit) | (np.sign(unsat) != np.sign(e))
+        self.integral += np.where(grow, e*dt, 0.0)
+
+        # clamp the integral term
+        with np.errstate(divide='ignore', invalid='ignore'):
+            imax = np.where(self.ki > 0, self.ilimit/self.ki, np.inf)
+        np.clip(self.integral, -imax, imax, out=self.integral)
+
+        np.clip(p + self.ki*self.integral + d, -self.limit, self.limit, out=self.out)
+
+        return self.out
@@ -0,0 +1,384 @@
+"""
+Pipeline of swappable stages: frame source -> detector -> tracker -> controller -> command sink.
+Stages are connected with bounded queues, every stage runs in its own thread or process,
+optionally pinned to cpu cores. The pipeline can be described in a JSON config file.
+
+Author: Vilmos Fernengel
+"""
+
+import os
+import json
+import time
+import queue
+import importlib
+import threading
+import multiprocessing
+
+
+class Stage():
+    """
+    Base of all stages. process() receives the item of the previous stage (dict), returns the item
+    for the next stage or None to drop it. Lifecycle hooks run in the thread / process of the stage.
+    """
+
+    # True if the stage needs the shared TelloConnect, such stages can't run in a separate process
+    uses_tello = False
+
+    def __init__(self, context=None, **kwargs) -> None:
+        self.context = context if context is not None else {}
+        self.name = self.__class__.__name__
+
+    def on_start(self):
+        """Called before the first item, in the stage thread / process
+        """
+        pass
+
+    def on_stop(self):
+        """Called after the last item, in the stage thread / process
+        """
+        pass
+
+    def process(self, item):
+        raise NotImplementedError
+
+
+class FrameSource(Stage):
+    """
+    First stage, produces the items. Raise StopIteration at the end of the stream.
+    """
+
+    def read(self):
+        """
+        Returns:
+            nxmx3: next frame, None if not available yet
+        """
+        raise NotImplementedError
+
+    def process(self, item):
+        frame = self.read()
+        if frame is None:
+            return None
+        return {'t':time.perf_counter(), 'frame':frame, 'shape':frame.shape}
+
+
+class Detector(Stage):
+    """
+    Adds 'tp' (target point [x, y, size]) and 'det' (list of (x,y,w,h)) to the item
+    """
+
+    def detect(self, frame):
+        """
+        Returns:
+            (list, list): target point, detections
+        """
+        raise NotImplementedError
+
+    def process(self, item):
+        item['tp'], item['det'] = self.detect(item['frame'])
+        return item
+
+
+class Tracker(Stage):
+    """
+    Adds 'target' to the item: (timestamp, [x, y, size, vx, vy, vsize]) velocities per second, None if no target
+    """
+
+    def update(self, item):
+        raise NotImplementedError
+
+    def process(self, item):
+        item['target'] = self.update(item)
+        return item
+
+
+class Controller(Stage):
+    """
+    Adds 'rc' (leftright, fwdbackw, updown, yaw) to the item
+    """
+
+    def control(self, item):
+        raise NotImplementedError
+
+    def process(self, item):
+        item['rc'] = self.control(item)
+        return item
+
+
+class CommandSink(Stage):
+    """
+    Last stage, emits the 'rc' of the item
+    """
+
+    def send(self, rc):
+        raise NotImplementedError
+
+    def process(self, item):
+        if item.get('rc') is not None:
+            self.send(item['rc'])
+        return item
+
+
+class Observer():
+    """
+    Receives the pipeline events: on_start(), on_item(stage name, item) of thread stages, on_stop()
+    """
+
+    def on_start(self, pipeline):
+        pass
+
+    def on_item(self, name, item):
+        pass
+
+    def on_stop(self, pipeline):
+        pass
+
+
+# built-in stage types of the config file, see utils/stages.py
+REGISTRY = {'video_source':'utils.stages:VideoSource',
+            'tello_source':'utils.stages:TelloSource',
+            'dnn_detector':'utils.stages:DnnDetector',
+            'kalman_tracker':'utils.stages:KalmanTracker',
+            'pid_controller':'utils.stages:PIDController',
+            'tello_sink':'utils.stages:TelloSink',
+            'print_observer':'utils.stages:PrintObserver'}
+
+
+def load_class(path):
+    """Class from 'package.module:Class' or a registry name
+    """
+    path = REGISTRY.get(path, path)
+    module, cls = path.split(':')
+    return getattr(importlib.import_module(module), cls)
+
+
+def build_stage(spec, context=None):
+    """Construct a stage from its config entry
+    """
+    return load_class(spec['type'])(context=context, **spec.get('args', {}))
+
+
+def _put(q, item, policy):
+    """Put with the queue policy: 'latest' drops the oldest item if full, 'block' waits
+    """
+    if policy == 'block':
+        q.put(item)
+        return
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def _run(stage, spec, inq, outq, stop, observers=()):
+    """Stage loop, same for threads and processes
+    """
+    rate = spec.get('rate', 0)
+    policy = spec.get('policy', 'latest')
+    last = None
+    t_next = time.perf_counter()
+
+    # failures of the start stop the pipeline too, on_stop() only after a successful on_start()
+    started = False
+    try:
+        cpus = spec.get('cpus')
+        if cpus and hasattr(os, 'sched_setaffinity'):
+            # pins the whole process for process placement, the calling thread on linux for thread placement
+            os.sched_setaffinity(0 if spec.get('placement') == 'process' else threading.get_native_id(), cpus)
+
+        stage.on_start()
+        started = True
+
+        while not stop.is_set():
+            if inq is None:
+                item = stage.process(None)
+            elif rate > 0:
+                # fixed rate: newest available item, the last one again if nothing new
+                t_next += 1.0/rate
+                while True:
+                    try:
+                        last = inq.get_nowait()
+                    except queue.Empty:
+                        break
+                if last is None:
+                    stop.wait(1.0/rate)
+                    continue
+                item = stage.process(dict(last))
+                dt = t_next - time.perf_counter()
+                if dt > 0: stop.wait(dt)
+                else: t_next = time.perf_counter()
+            else:
+                try:
+                    item = inq.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                item = stage.process(item)
+
+            if item is None:
+                continue
+
+            for ob in observers:
+                ob.on_item(spec['name'], item)
+
+            if outq is not None:
+                _put(outq, item, policy)
+    except StopIteration:
+        # end of stream stops the whole pipeline
+        stop.set()
+    except Exception as e:
+        # a dead stage stops the whole pipeline, the sink must not keep commanding on stale items
+        print ("stage {} failed: {}".format(spec['name'], repr(e)))
+        stop.set()
+    finally:
+        if started: stage.on_stop()
+
+
+def _run_process(spec, inq, outq, stop):
+    """Entry of process placed stages, the stage is built in the child process
+    """
+    try:
+        stage = build_stage(spec)
+    except Exception as e:
+        print ("stage {} failed: {}".format(spec['name'], repr(e)))
+        stop.set()
+        return
+    _run(stage, spec, inq, outq, stop)
+
+
+class Pipeline():
+    """
+    Chain of stages with bounded queues. Optional 'ego': EgoMotion args, see utils/egomotion.py. Config entry of a stage:
+        name: stage name
+        type: registry name or 'package.module:Class'
+        args: constructor arguments
+        placement: 'thread' (default) or 'process'
+        cpus: list of cpu cores to pin the stage to (linux)
+        queue: size of the input queue, default 1
+        policy: 'latest' (default, oldest item dropped) or 'block' on the output queue
+        rate: process the newest item at this fixed rate [Hz], 0 - on every item
+    """
+
+    def __init__(self, config) -> None:
+        """
+        Args:
+            config (dict): {'tello': TelloConnect args or absent, 'stages': [...], 'observers': [...]}
+        """
+        self.config = config
+        self.context = {}
+        self.stop_ev = multiprocessing.Event()
+        self.runners = []
+        self.queues = []
+        self.observers = []
+
+        # shared tello connection, created if configured
+        if 'tello' in config:
+            from . import telloconnect
+            tcfg = dict(config['tello'])
+            self.timeout = tcfg.pop('TIMEOUT', None)
+            image_size = tcfg.pop('IMAGE_SIZE', (640,480))
+            self.context['tello'] = telloconnect.TelloConnect(**tcfg)
+            self.context['tello'].set_image_size(tuple(image_size))
+
+        # ego-motion compensation of the tracker / controller, fed with the tello state stream
+        if 'ego' in config:
+            from . import egomotion
+            if 'tello' not in self.context:
+                raise ValueError("ego needs the tello state stream, configure 'tello'")
+            self.context['ego'] = egomotion.EgoMotion(**config['ego'])
+            self.context['tello'].add_state_listener(self.context['ego'].update)
+
+        # cores available for pinning
+        cores = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else range(os.cpu_count() or 1)
+
+        self.stages = []
+        for spec in config['stages']:
+            spec = dict(spec)
+            spec.setdefault('name', spec['type'])
+            spec.setdefault('placement', 'thread')
+            bad = [c for c in spec.get('cpus') or [] if c not in cores]
+            if len(bad) > 0:
+                raise ValueError("stage {}: cpus {} not available, cores: {}".format(spec['name'], bad, sorted(cores)))
+            if spec['placement'] == 'process':
+                if getattr(load_class(spec['type']), 'uses_tello', False):
+                    raise ValueError("stage {} uses the tello connection, can't run in a process".format(spec['name']))
+                stage = None
+            else:
+                stage = build_stage(spec, self.context)
+            self.stages.append((spec, stage))
+
+        for ob in config.get('observers', []):
+            self.add_observer(load_class(ob['type'])(**ob.get('args', {})))
+
+    @classmethod
+    def from_file(cls, path):
+        """Pipeline from a JSON config file
+        """
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def add_observer(self, observer):
+        """
+        Args:
+            observer (Observer): receives the events of the thread stages
+        """
+        self.observers.append(observer)
+
+    def start(self):
+        """Connect tello (if configured), start all stages, last stage first
+        """
+        tello = self.context.get('tello')
+        if tello is not None:
+            if not tello.wait_till_connected(TIMEOUT=self.timeout):
+                raise TimeoutError("Tello not connected in {} s".format(self.timeout))
+            tello.start_communication()
+
+        for ob in self.observers:
+            ob.on_start(self)
+
+        # queues between the stages, multiprocessing queues next to process stages
+        queues = [None]
+        for i in range(1, len(self.stages)):
+            size = self.stages[i][0].get('queue', 1)
+            mp = 'process' in (self.stages[i-1][0]['placement'], self.stages[i][0]['placement'])
+            queues.append(multiprocessing.Queue(size) if mp else queue.Queue(size))
+        queues.append(None)
+        self.queues = queues
+
+        for i in reversed(range(len(self.stages))):
+            spec, stage = self.stages[i]
+            if spec['placement'] == 'process':
+                r = multiprocessing.Process(target=_run_process, args=(spec, queues[i], queues[i+1], self.stop_ev), daemon=True)
+            else:
+                r = threading.Thread(target=_run, args=(stage, spec, queues[i], queues[i+1], self.stop_ev, self.observers), daemon=True)
+            r.start()
+            self.runners.append(r)
+
+    def running(self):
+        """
+        Returns:
+            bool: False after stop() or end of stream
+        """
+        return not self.stop_ev.is_set()
+
+    def stop(self, timeout=2.0):
+        """Stop all stages, wait for them, disconnect tello
+        """
+        self.stop_ev.set()
+        for r in self.runners:
+            r.join(timeout)
+
+        # items left in a multiprocessing queue would block the exit
+        for q in self.queues:
+            if hasattr(q, 'cancel_join_thread'): q.cancel_join_thread()
+
+        for ob in self.observers:
+            ob.on_stop(self)
+
+        tello = self.context.get('tello')
+        if tello is not None:
+            tello.send_cmd('rc 0 0 0 0')
+            tello.stop_communication()
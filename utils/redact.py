@@ -0,0 +1,145 @@
+import cv2
+import time
+import queue
+from . import safethread
+
+
+class Redactor():
+    """
+    Privacy redaction stage. Pixelates / blurs the detected face or person regions
+    (downscale + upscale of the crop only), in its own worker, then passes the frame to the sinks.
+    """
+
+    def __init__(self, MODE='pixelate', BLOCK=12, MARGIN=0.2, HOLD=0.5, QUEUE=4, SINKS=None) -> None:
+        """
+        Args:
+            MODE (str, optional): ['pixelate', 'blur']. Defaults to 'pixelate'.
+            BLOCK (int, optional): downscale factor of the region. Defaults to 12.
+            MARGIN (float, optional): region enlarged by this ratio, covers the detection lag. Defaults to 0.2.
+            HOLD (float, optional): last regions are kept for HOLD [s] if no detection. Defaults to 0.5.
+            QUEUE (int, optional): frames waiting for redaction, oldest dropped if full. Defaults to 4.
+            SINKS (list, optional): callables receiving the redacted frames. Defaults to None.
+        """
+        self.mode = MODE
+        self.block = BLOCK
+        self.margin = MARGIN
+        self.hold = HOLD
+        self.sinks = list(SINKS) if SINKS is not None else []
+
+        self.q = queue.Queue(maxsize=QUEUE)
+
+        # last detections, for frames without detection
+        self.last_det = None
+        self.t_det = 0.0
+
+        # redaction statistics, see get_stats()
+        self.stats = {'frames':0, 'drops':0, 'regions':0, 'redact_ms':0.0, 'max_ms':0.0}
+
+        self.wt = safethread.SafeThread(target=self.__worker)
+        self.wt.start()
+
+    def add_sink(self, sink):
+        """
+        Add a consumer of the redacted frames
+        Args:
+            sink (callable): called with the redacted frame
+        """
+        self.sinks.append(sink)
+
+    def put(self, img, det):
+        """
+        Queue a frame for redaction, never blocks
+        Args:
+            img (nxmx3): RGB image, not modified
+            det (list): detections (x,y,w,h) of the frame, None if no detection
+        """
+        item = (img, None if det is None else list(det), time.perf_counter())
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            # drop the oldest frame
+            try:
+                self.q.get_nowait()
+                self.stats['drops'] += 1
+            except queue.Empty:
+                pass
+            self.q.put_nowait(item)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: redacted frames, dropped frames, redacted regions, redaction time [ms] (average, max)
+        """
+        return dict(self.stats)
+
+    def stop(self, DRAIN=True, TIMEOUT=2.0):
+        """
+        Stop the worker thread and wait for it, the sinks can be closed afterwards
+        Args:
+            DRAIN (bool, optional): redact and forward the queued frames, in the calling thread. Defaults to True.
+            TIMEOUT (float, optional): max wait for the worker [s]. Defaults to 2.0.
+        """
+        self.wt.stop()
+        if self.wt.is_alive(): self.wt.join(TIMEOUT)
+
+        while DRAIN:
+            try:
+                self.__process(*self.q.get_nowait())
+            except queue.Empty:
+                break
+
+    def redact(self, img, det):
+        """
+        Redact the regions in place
+        Args:
+            img (nxmx3): RGB image
+            det (list): regions (x,y,w,h)
+        """
+        h,w = img.shape[:2]
+        for d in det:
+            mx, my = int(d[2]*self.margin), int(d[3]*self.margin)
+            x0, y0 = max(0, int(d[0])-mx), max(0, int(d[1])-my)
+            x1, y1 = min(w, int(d[0]+d[2])+mx), min(h, int(d[1]+d[3])+my)
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            roi = img[y0:y1, x0:x1]
+            small = cv2.resize(roi, (max(1,(x1-x0)//self.block), max(1,(y1-y0)//self.block)), interpolation=cv2.INTER_AREA)
+            interp = cv2.INTER_NEAREST if self.mode == 'pixelate' else cv2.INTER_LINEAR
+            img[y0:y1, x0:x1] = cv2.resize(small, (x1-x0, y1-y0), interpolation=interp)
+
+    def __worker(self):
+        """Worker thread, redacts and forwards the queued frames
+        """
+        try:
+            img, det, t = self.q.get(timeout=0.1)
+        except queue.Empty:
+            return
+
+        self.__process(img, det, t)
+
+    def __process(self, img, det, t):
+        """Redact a frame, forward it to the sinks
+        """
+        # keep the last regions for a while, detection can miss a few frames
+        if det is not None and len(det) > 0:
+            self.last_det = det
+            self.t_det = t
+        elif t - self.t_det < self.hold:
+            det = self.last_det
+        else:
+            det = None
+
+        t0 = time.perf_counter()
+        out = img.copy()
+        if det is not None:
+            self.redact(out, det)
+            self.stats['regions'] += len(det)
+        dt = (time.perf_counter() - t0)*1000.0
+
+        self.stats['frames'] += 1
+        self.stats['redact_ms'] += (dt - self.stats['redact_ms'])/self.stats['frames']
+        self.stats['max_ms'] = max(self.stats['max_ms'], dt)
+
+        for sink in self.sinks:
+            sink(out)
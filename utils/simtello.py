@@ -0,0 +1,167 @@
+"""
+Simulated Tello, replays a recorded clip and records the commands sent.
+Drop-in replacement of TelloConnect for headless runs (benchmark, evaluation).
+
+Author: Vilmos Fernengel
+"""
+
+import time
+import threading
+
+class SimTello:
+    import cv2
+
+    def __init__(self, VIDEO_SOURCE, IMAGE_SIZE=(640,480), REALTIME=True, MAXFRAMES=0) -> None:
+        """
+        Args:
+            VIDEO_SOURCE (str): recorded clip to be replayed
+            IMAGE_SIZE (tuple, optional): size of the returned frames. Defaults to (640,480).
+            REALTIME (bool, optional): pace the frames with the clip frame rate. Defaults to True.
+            MAXFRAMES (int, optional): stop after n frames, 0 - full clip. Defaults to 0.
+        """
+
+        self.video_source = VIDEO_SOURCE
+        self.image_size = IMAGE_SIZE
+        self.realtime = REALTIME
+        self.maxframes = MAXFRAMES
+
+        self.debug = True
+
+        # same interface as TelloConnect
+        self.state_value = []
+        self.state_listeners = []
+        self.eventlist = list()
+        self.frame = None
+
+        self.video = self.cv2.VideoCapture(self.video_source)
+        fps = self.video.get(self.cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else 30.0
+
+        # replay state
+        self.frame_count = 0
+        self.finished = False
+        self.t_last = None
+
+        # sent commands, list of (timestamp, cmd)
+        self.commands = []
+        self.lock = threading.Lock()
+
+        # simulated drone state, updated by the 'rc' commands
+        self.rc = [0,0,0,0]
+        self.yaw = 0.0
+        self.height = 0.0
+        self.t_state = time.perf_counter()
+        self.__update_state()
+
+    def set_image_size(self, image_size=(960,720)):
+        """Set size of the returned image
+
+        Args:
+            image_size (tuple, optional): Retun image size. Defaults to (960,720).
+        """
+        self.image_size = image_size
+
+    def get_frame(self):
+        """Next frame of the clip
+
+        Returns:
+            (w,h,3) array: frame, None at the end of the clip
+        """
+        if self.finished:
+            return None
+
+        if self.maxframes > 0 and self.frame_count >= self.maxframes:
+            self.finished = True
+            return None
+
+        ret, frame = self.video.read()
+        if not ret:
+            self.finished = True
+            return None
+
+        # keep the clip frame rate
+        if self.realtime and self.t_last is not None:
+            dt = 1.0/self.fps - (time.perf_counter() - self.t_last)
+            if dt > 0: time.sleep(dt)
+        self.t_last = time.perf_counter()
+
+        self.frame = self.cv2.resize(frame, self.image_size)
+        self.frame_count += 1
+        self.__update_state()
+
+        return self.frame
+
+    def __update_state(self):
+        """Integrate the last rc command, fill the state in the Tello SDK format
+        """
+        t = time.perf_counter()
+        dt = t - self.t_state
+        self.t_state = t
+
+        # rough rc -> [deg/s, cm/s] mapping
+        self.yaw = (self.yaw + self.rc[3]*dt + 180.0) % 360.0 - 180.0
+        self.height = max(0.0, self.height + self.rc[2]*dt)
+
+        val = 'pitch:0;roll:0;yaw:{yaw};vgx:{vgx};vgy:{vgy};vgz:{vgz};templ:60;temph:62;tof:{tof};h:{h};bat:100;baro:0.00;time:0;agx:0.00;agy:0.00;agz:-1000.00;'.format(
+            yaw=int(self.yaw), vgx=self.rc[1]//10, vgy=self.rc[0]//10, vgz=-self.rc[2]//10, tof=int(self.height)+10, h=int(self.height))
+        self.state_value = val.replace(';',':').split(':')
+
+        for listener in self.state_listeners:
+            listener(self.state_value, t)
+
+    def add_state_listener(self, listener):
+        """Register a callback for the state updates, see TelloConnect
+        """
+        self.state_listeners.append(listener)
+
+    def add_periodic_event(self,cmd,period,info=''):
+        """Add periodic commands to the list, never sent
+        """
+        self.eventlist.append({'cmd':str(cmd),'period':int(period),'info':str(info), 'val':str("")})
+
+    def send_cmd(self,cmd):
+        """Record a command
+
+        Args:
+            cmd (str): See Tello SDK for walid commands
+        """
+        cmd = str(cmd)
+        with self.lock:
+            self.commands.append((time.perf_counter(), cmd))
+
+        val = cmd.split()
+        if len(val) == 5 and val[0] == 'rc':
+            self.rc = [int(float(v)) for v in val[1:]]
+
+    def send_cmd_return(self,cmd):
+        """Record a command, always acknowledged
+
+        Returns:
+            [str]: 'ok'
+        """
+        self.send_cmd(cmd)
+        return 'ok'
+
+    def get_commands(self):
+        """Copy of the recorded commands
+
+        Returns:
+            list: (timestamp, cmd) tuples
+        """
+        with self.lock:
+            return list(self.commands)
+
+    def wait_till_connected(self):
+        pass
+
+    def start_communication(self):
+        pass
+
+    def stop_communication(self):
+        pass
+
+    def start_video(self):
+        pass
+
+    def stop_video(self):
+        self.video.release()
@@ -0,0 +1,241 @@
+"""
+Built-in pipeline stages, wrapping the existing building blocks
+(TelloConnect, DnnObjectDetect, clKalman, VectorPID, EgoMotion), see utils/pipeline.py.
+KalmanTracker and PIDController are the control loop of FollowObject too.
+
+Author: Vilmos Fernengel
+"""
+
+import time
+import numpy as np
+from .pipeline import FrameSource, Detector, Tracker, Controller, CommandSink, Observer
+
+
+class VideoSource(FrameSource):
+    """
+    Frames from a video file or stream
+    """
+
+    def __init__(self, context=None, PATH='', IMAGE_SIZE=(640,480), REALTIME=True) -> None:
+        super().__init__(context)
+        self.path = PATH
+        self.image_size = tuple(IMAGE_SIZE)
+        self.realtime = REALTIME
+        self.video = None
+
+    def on_start(self):
+        import cv2
+        self.cv2 = cv2
+        self.video = cv2.VideoCapture(self.path)
+        fps = self.video.get(cv2.CAP_PROP_FPS)
+        self.period = 1.0/fps if fps > 0 else 1.0/30
+        self.t_next = time.perf_counter()
+
+    def on_stop(self):
+        self.video.release()
+
+    def read(self):
+        ret, frame = self.video.read()
+        if not ret:
+            raise StopIteration
+
+        # keep the stream frame rate
+        if self.realtime:
+            dt = self.t_next - time.perf_counter()
+            if dt > 0: time.sleep(dt)
+            self.t_next = max(self.t_next + self.period, time.perf_counter() - self.period)
+
+        return self.cv2.resize(frame, self.image_size)
+
+
+class TelloSource(FrameSource):
+    """
+    Frames of the shared TelloConnect
+    """
+    uses_tello = True
+
+    def on_start(self):
+        self.context['tello'].start_video()
+
+    def on_stop(self):
+        self.context['tello'].stop_video()
+
+    def read(self):
+        return self.context['tello'].get_frame()
+
+
+class DnnDetector(Detector):
+    """
+    DnnObjectDetect, the model is loaded and warmed up in on_start, in the stage thread / process
+    """
+
+    def __init__(self, context=None, MODEL='', PROTO='', CONFIDENCE=0.7, DETECT='Face', SIZE=(300,300), THREADS=0) -> None:
+        super().__init__(context)
+        self.model = MODEL
+        self.proto = PROTO
+        self.confidence = CONFIDENCE
+        self.detect_type = DETECT
+        self.size = tuple(SIZE)
+        self.threads = THREADS
+        self.detector = None
+
+    def on_start(self):
+        import cv2
+        from . import dnnobjectdetect
+
+        if self.threads > 0: cv2.setNumThreads(self.threads)
+        if self.model != '' and self.proto != '':
+            self.detector = dnnobjectdetect.DnnObjectDetect(self.model, self.proto, CONFIDENCE=self.confidence, DETECT=self.detect_type)
+        else:
+            self.detector = dnnobjectdetect.DnnObjectDetect(CONFIDENCE=self.confidence, DETECT=self.detect_type)
+        self.detector.warmup(size=self.size)
+
+    def detect(self, frame):
+        return self.detector.detect(frame, size=self.size)
+
+
+class KalmanTracker(Tracker):
+    """
+    Kalman estimate of the target position and size, dropped after TIMEOUT [s] without detection.
+    With an EgoMotion in the context ('ego') the estimate is kept in the stabilized frame:
+    the drone motion since the target acquisition (pose_ref) is removed. Used by FollowObject too.
+    """
+
+    def __init__(self, context=None, PROCESS_NOISE=0.01, MEASUREMENT_NOISE=1.0, TIMEOUT=1.0) -> None:
+        super().__init__(context)
+        self.noise = (PROCESS_NOISE, MEASUREMENT_NOISE)
+        self.timeout = TIMEOUT
+        self.target = None
+
+        # drone pose at target acquisition, see EgoMotion.pose()
+        self.pose_ref = None
+
+    def reset(self):
+        """Drop the target, estimators restart with the next detection
+        """
+        self.target = None
+
+    def update(self, item):
+        from . import kalman
+
+        t = item['t']
+        tp = item.get('tp')
+        target = self.target
+        ego = self.context.get('ego')
+
+        if tp is None or len(item.get('det', [])) == 0:
+            if target is not None and t - target[0] > self.timeout:
+                self.target = None
+        # same image processed again
+        elif target is None or t > target[0]:
+            # (re)init estimators on new target
+            if target is None or t - target[0] > self.timeout:
+                target = None
+                self.pose_ref = ego.pose(t) if ego is not None else None
+                self.kfxy = kalman.clKalman()
+                self.kfsize = kalman.clKalman()
+                self.kfxy.set_noise(*self.noise)
+                self.kfsize.set_noise(*self.noise)
+                self.kfxy.init(tp[0],tp[1])
+                self.kfsize.init(1,tp[2])
+
+            # estimate in the stabilized frame: remove the drone motion since the target was acquired
+            x,y = tp[0],tp[1]
+            if ego is not None and self.pose_ref is not None:
+                dx,dy = ego.shift_since(self.pose_ref, t)
+                x,y = x-dx, y-dy
+
+            sxy = self.kfxy.correctState(x,y)
+            ss = self.kfsize.correctState(1,tp[2])
+
+            # estimator step is one detection, convert velocities to per second
+            dt = max(1e-3, t - target[0]) if target is not None else 1.0
+            self.target = (t, np.array([sxy[0], sxy[1], ss[1], sxy[2]/dt, sxy[3]/dt, ss[3]/dt]))
+
+        item['pose_ref'] = self.pose_ref
+        return self.target
+
+
+class PIDController(Controller):
+    """
+    VectorPID on the extrapolated target estimate, hover if no target or the estimate is older than TIMEOUT [s].
+    With an EgoMotion in the context ('ego') the estimate is moved back to the image frame. Used by FollowObject too.
+    """
+
+    def __init__(self, context=None, KP=(0.17,0.33,0.25,0.17), KI=(0.0,0.0,0.0,0.0), KD=(0.0,0.0,0.0,0.0), LIMIT=40,
+                 SETPOINT=100, HORIZONTAL=False, VERTICAL=True, DISTANCE=True, ROTATION=True, HORIZON=0.3, TIMEOUT=1.0) -> None:
+        super().__init__(context)
+        from . import pidcontrol
+
+        self.pid = pidcontrol.VectorPID(KP=KP, KI=KI, KD=KD, LIMIT=LIMIT)
+        self.setpoint = SETPOINT
+        self.horizon = HORIZON
+        self.timeout = TIMEOUT
+
+        self.mask = np.zeros(4)
+        self.set_tracking(HORIZONTAL, VERTICAL, DISTANCE, ROTATION)
+        self.err = np.zeros(4)
+        self.t_last = None
+
+    def set_tracking(self, HORIZONTAL=False, VERTICAL=True, DISTANCE=True, ROTATION=True):
+        """Error mask [leftright, fwdbackw, updown, yaw], don't combine horizontal and rotation
+        """
+        self.mask[:] = [HORIZONTAL and not ROTATION, DISTANCE, VERTICAL, ROTATION]
+
+    def control(self, item):
+        now = time.perf_counter()
+        dt = now - self.t_last if self.t_last is not None else 0.05
+        self.t_last = now
+
+        target = item.get('target')
+        if target is None or now - target[0] > self.timeout:
+            # no target, keep position
+            self.pid.reset()
+            return (0,0,0,0)
+
+        # extrapolate the estimate to now
+        h,w = item['shape'][:2]
+        x,y,size = target[1][:3] + target[1][3:]*min(now - target[0], self.horizon)
+
+        # back to the image frame, with the drone motion till now
+        ego = self.context.get('ego')
+        pose_ref = item.get('pose_ref')
+        if ego is not None and pose_ref is not None:
+            dx,dy = ego.shift_since(pose_ref, now)
+            x,y = x+dx, y+dy
+
+        self.err[:] = [x - w//2, self.setpoint - size, h//2 - y, x - w//2]
+        self.err *= self.mask
+
+        return tuple(int(round(v)) for v in self.pid.update(self.err, dt))
+
+
+class TelloSink(CommandSink):
+    """
+    rc commands to the shared TelloConnect
+    """
+    uses_tello = True
+
+    def send(self, rc):
+        self.context['tello'].send_cmd("rc {} {} {} {}".format(*rc))
+
+        ego = self.context.get('ego')
+        if ego is not None: ego.command(rc)
+
+    def on_stop(self):
+        # keep position
+        self.context['tello'].send_cmd('rc 0 0 0 0')
+
+
+class PrintObserver(Observer):
+    """
+    Prints the items of a stage
+    """
+
+    def __init__(self, STAGE='', KEYS=('rc',)) -> None:
+        self.stage = STAGE
+        self.keys = KEYS
+
+    def on_item(self, name, item):
+        if self.stage == '' or name == self.stage:
+            print (name, {k:item.get(k) for k in self.keys})
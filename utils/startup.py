@@ -0,0 +1,125 @@
+"""
+Startup orchestration. Model load / warm-up runs in parallel with the
+socket setup, connection handshake and video stream opening.
+
+Author: Vilmos Fernengel
+"""
+
+import time
+import threading
+from . import telloconnect
+from . import dnnobjectdetect
+from . import followobject
+
+
+class StartupOrchestrator:
+    """
+    Starts TelloConnect and FollowObject, records the duration of every startup stage
+    """
+
+    def __init__(self, MODEL='', PROTO='', CONFIDENCE=0.7, DETECT='Face', IMAGE_SIZE=(640,480), TIMEOUT=None, CONTROL_RATE=0, **kwargs) -> None:
+        """
+        Args:
+            MODEL (str, optional): DNN model, '' - detector default. Defaults to ''.
+            PROTO (str, optional): prototxt, '' - detector default. Defaults to ''.
+            CONFIDENCE (float, optional): detection confidence. Defaults to 0.7.
+            DETECT (str, optional): ['Face', 'Person']. Defaults to 'Face'.
+            IMAGE_SIZE (tuple, optional): video size. Defaults to (640,480).
+            TIMEOUT (float, optional): connection timeout in seconds, None - wait forever. Defaults to None.
+            CONTROL_RATE (float, optional): fixed control loop rate [Hz], 0 - command after detection. Defaults to 0.
+            kwargs: passed to TelloConnect
+        """
+        self.model = MODEL
+        self.proto = PROTO
+        self.confidence = CONFIDENCE
+        self.detect = DETECT
+        self.image_size = IMAGE_SIZE
+        self.timeout = TIMEOUT
+        self.control_rate = CONTROL_RATE
+        self.tello_kwargs = kwargs
+
+        self.tello = None
+        self.detector = None
+        self.fobj = None
+
+        # stage -> (start, end), time.perf_counter()
+        self.stages = {}
+        self.t0 = None
+
+        # exception raised in a startup thread
+        self.error = None
+
+    def __stage(self, name, fn):
+        """Run and time a startup stage
+        """
+        t = time.perf_counter()
+        ret = fn()
+        self.stages[name] = (t, time.perf_counter())
+        return ret
+
+    def __load_model(self):
+        """Model load and warm-up
+        """
+        try:
+            if self.model != '' and self.proto != '':
+                self.detector = self.__stage('model load', lambda: dnnobjectdetect.DnnObjectDetect(self.model, self.proto, CONFIDENCE=self.confidence, DETECT=self.detect))
+            else:
+                self.detector = self.__stage('model load', lambda: dnnobjectdetect.DnnObjectDetect(CONFIDENCE=self.confidence, DETECT=self.detect))
+
+            self.__stage('model warm-up', lambda: self.detector.warmup(self.image_size))
+        except Exception as e:
+            self.error = e
+
+    def __connect(self):
+        """Socket setup, connection handshake, stream opening
+        """
+        try:
+            self.tello = self.__stage('socket setup', lambda: telloconnect.TelloConnect(**self.tello_kwargs))
+            self.tello.set_image_size(self.image_size)
+
+            if not self.__stage('connection', lambda: self.tello.wait_till_connected(TIMEOUT=self.timeout)):
+                raise TimeoutError("Tello not connected in {} s".format(self.timeout))
+
+            # stream must be on before opening, start_video() repeats the (idempotent) streamon
+            self.tello.start_communication()
+            self.tello.send_cmd('streamon')
+            self.__stage('stream open', self.tello.open_video)
+            self.tello.start_video()
+        except Exception as e:
+            self.error = e
+
+    def run(self):
+        """Start all the stages concurrently, wait till all finished
+
+        Returns:
+            (TelloConnect, FollowObject): connected tello, running object follower
+        """
+        self.t0 = time.perf_counter()
+
+        threads = [threading.Thread(target=self.__load_model, daemon=True),
+                   threading.Thread(target=self.__connect, daemon=True)]
+        for th in threads: th.start()
+        for th in threads: th.join()
+
+        if self.error is not None:
+            raise self.error
+
+        self.fobj = self.__stage('tracker start', lambda: followobject.FollowObject(self.tello, CONFIDENCE=self.confidence, DETECT=self.detect, DETECTOR=self.detector, CONTROL_RATE=self.control_rate))
+
+        return self.tello, self.fobj
+
+    def report(self):
+        """Startup breakdown, relative to run()
+
+        Returns:
+            str: stage durations, time-to-first-frame, time-to-first-command
+        """
+        lines = []
+        for name, (t_start, t_end) in sorted(self.stages.items(), key=lambda v: v[1][0]):
+            lines.append("{:<16} {:7.3f} s -> {:7.3f} s ({:.3f} s)".format(name, t_start-self.t0, t_end-self.t0, t_end-t_start))
+
+        for name, t in [('first frame', self.tello.t_first_frame if self.tello else None),
+                        ('first command', self.tello.t_first_rc if self.tello else None)]:
+            lines.append("{:<16} {}".format(name, '-' if t is None else "{:7.3f} s".format(t-self.t0)))
+
+        return '\n'.join(lines)
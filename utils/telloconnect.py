@@ -4,15 +4,18 @@ Connet Tello over UDP. Sends periodic commands, and receive camera images
 Author: Vilmos Fernengel
 """
 
+import os
+import time
 import threading
 from . import safethread
+from . import framering
 
 class TelloConnect:
     import socket
     import cv2
     from queue import Queue
 
-    def __init__(self,TELLOIP='192.168.10.1', UDPPORT=8889, VIDEO_SOURCE="udp://@0.0.0.0:11111",UDPSTATEPORT=8890, DEBUG=False) -> None:
+    def __init__(self,TELLOIP='192.168.10.1', UDPPORT=8889, VIDEO_SOURCE="udp://@0.0.0.0:11111",UDPSTATEPORT=8890, DEBUG=False, LOW_LATENCY=False, SHM_NAME='', SHM_SLOTS=4) -> None:
 
         self.localaddr = ('',UDPPORT)
         self.telloaddr = (TELLOIP,UDPPORT)
@@ -23,6 +26,9 @@ class TelloConnect:
 
         # record satate value
         self.state_value = []
+
+        # called with (state_value, time.perf_counter()) on every state packet
+        self.state_listeners = []
     
         # image size
         self.image_size = (640,480)
@@ -38,6 +44,70 @@ class TelloConnect:
         # store a single image
         self.frame = None
 
+        # video stream, see open_video()
+        self.video = None
+
+        # low latency ingest: newest frame is served, backlog is dropped, stalled stream is reopened
+        self.low_latency = LOW_LATENCY
+        self.frame_cv = threading.Condition()
+        self.frame_seq = 0
+        self.read_seq = 0
+        self.t_frame = 0.0
+        self.t_grab_ok = time.perf_counter()
+
+        # backlog: stream position behind wall time more than drain_lag [s], max_drain frames dropped in a row.
+        # t_offset: wall time - stream position of the least delayed frame, files are paced with it
+        self.drain_lag = 0.1
+        self.max_drain = 10
+        self.drained = 0
+        self.t_offset = None
+        self.last_pos = -1.0
+        self.video_file = isinstance(VIDEO_SOURCE, str) and os.path.isfile(VIDEO_SOURCE)
+
+        # no stream position: grab faster than drain_threshold [s] with the previous frame unread is backlog
+        self.drain_threshold = 0.008
+
+        # stream declared stalled after stall_timeout [s], reopen waits reconnect_backoff [s], doubled on failure
+        self.stall_timeout = 2.0
+        self.reconnect_backoff = 0.5
+        self.video_ev = threading.Event()
+
+        # reopen requested from outside (link supervisor), done in the video thread
+        self.video_reopen = False
+
+        # publish frames into a named shared memory ring, '' - disabled, created by start_video()
+        self.shm_name = SHM_NAME
+        self.shm_slots = SHM_SLOTS
+        self.ring = None
+
+        # publish and close of the ring are exclusive, close unmaps the buffer
+        self.ring_lock = threading.Lock()
+
+        # ingest statistics, see get_video_stats()
+        self.video_stats = {'frames':0, 'drops':0, 'errors':0, 'reconnects':0, 'decode_ms':0.0, 'age_ms':0.0, 'last_error':''}
+
+        # link health: time.perf_counter() of the last command ack / state packet / frame, packet counters, swallowed errors
+        self.t_ack = None
+        self.t_state = None
+        self.t_last_frame = None
+        self.link_counts = {'acks':0, 'states':0}
+        self.link_errors = {'cmd':0, 'state':0, 'periodic':0, 'send':0}
+        self.last_error = ''
+        self.link_ev = threading.Event()
+
+        # failsafe active: rc commands are dropped, just the forced ones are sent, see send_cmd()
+        self.failsafe = False
+
+        # receive timeout [s], the receive threads see a rebind request within this time
+        self.sock_timeout = 0.2
+
+        # sockets to be rebound by their receive thread, see rebind_sockets()
+        self.rebind = set()
+
+        # startup timestamps, time.perf_counter() of the first frame / first rc command
+        self.t_first_frame = None
+        self.t_first_rc = None
+
         # scheduler counter
         self.count = 1
 
@@ -54,12 +124,10 @@ class TelloConnect:
         self.eventlist.append({'cmd':'command','period':100,'info':''})
 
         # # create UDP packet, for commands
-        self.sock_cmd = self.socket.socket(self.socket.AF_INET, self.socket.SOCK_DGRAM)
-        self.sock_cmd.bind(self.localaddr)
+        self.sock_cmd = self.__bind(self.localaddr)
 
         # tello state
-        self.sock_state = self.socket.socket(self.socket.AF_INET, self.socket.SOCK_DGRAM)
-        self.sock_state.bind(self.stateaddr)
+        self.sock_state = self.__bind(self.stateaddr)
 
         # start receive thread
         self.receiverThread = safethread.SafeThread(target=self.__receive)
@@ -86,30 +154,190 @@ class TelloConnect:
         """get frame from queue
 
         Returns:
-            (w,h,3) array: 920x720 RGB frame
+            (w,h,3) array: 920x720 RGB frame, in low latency mode None if no new frame arrived in 1 s
         """
+        if self.low_latency:
+            with self.frame_cv:
+                if not self.frame_cv.wait_for(lambda: self.frame_seq != self.read_seq, timeout=1.0):
+                    return None
+                self.read_seq = self.frame_seq
+                self.video_stats['age_ms'] = (time.perf_counter() - self.t_frame)*1000.0
+                return self.frame
+
         #return self.frame
         return self.q.get()
 
+    def get_video_stats(self):
+        """Video ingest statistics
+
+        Returns:
+            dict: published frames, dropped frames, decoder errors, reconnects, decode time [ms], age of the last served frame [ms], last error
+        """
+        return dict(self.video_stats)
+
     def __video(self):
         """Video thread
         """
 
         # stream handling
-        self.video = self.cv2.VideoCapture(self.video_source)
+        if self.video is None: self.open_video()
+
+        if self.low_latency:
+            return self.__video_low_latency()
+
         while True:
             try: 
+                if self.video_reopen:
+                    self.video_reopen = False
+                    self.reopen_video()
+
                 # frame from stream
                 ret, frame = self.video.read()
 
                 if ret:
                     frame = self.cv2.resize(frame,self.image_size)           
                     self.frame = frame
+                    self.t_last_frame = time.perf_counter()
+                    if self.t_first_frame is None: self.t_first_frame = self.t_last_frame
+                    self.video_stats['frames'] += 1
                     self.q.put(frame)
+                    self.__publish(frame)
 
-            except Exception:
-                pass
+            except Exception as e:
+                self.__error('video', e)
         
+    def __video_low_latency(self):
+        """Video thread cycle in low latency mode, grabs a frame, decodes to BGR just the newest one
+        """
+        try:
+            if self.video_reopen:
+                self.video_reopen = False
+                self.reopen_video()
+
+            t0 = time.perf_counter()
+            ret = self.video.isOpened() and self.video.grab()
+            t1 = time.perf_counter()
+
+            if not ret:
+                self.video_stats['errors'] += 1
+                if t1 - self.t_grab_ok > self.stall_timeout:
+                    self.reopen_video()
+                else:
+                    self.video_ev.wait(0.05)
+                return
+            self.t_grab_ok = t1
+            self.reconnect_backoff = 0.5
+
+            if self.__backlog(t0, t1) and self.drained < self.max_drain:
+                self.drained += 1
+                self.video_stats['drops'] += 1
+                return
+            self.drained = 0
+
+            t_dec = time.perf_counter()
+            ret, frame = self.video.retrieve()
+            if not ret:
+                self.video_stats['errors'] += 1
+                return
+            frame = self.cv2.resize(frame,self.image_size)
+            t2 = time.perf_counter()
+
+            with self.frame_cv:
+                # previous frame was not served
+                if self.frame_seq != self.read_seq: self.video_stats['drops'] += 1
+                self.frame = frame
+                self.frame_seq += 1
+                self.t_frame = t2
+                self.frame_cv.notify_all()
+
+            self.t_last_frame = t2
+            if self.t_first_frame is None: self.t_first_frame = t2
+            self.__publish(frame)
+            self.video_stats['frames'] += 1
+            self.video_stats['decode_ms'] = 0.9*self.video_stats['decode_ms'] + 0.1*(t1 - t0 + t2 - t_dec)*1000.0
+
+        except Exception as e:
+            self.video_stats['errors'] += 1
+            self.video_stats['last_error'] = str(e)
+            if self.debug: print ("video: " + str(e))
+
+    def __backlog(self, t0, t1):
+        """True if the grabbed frame is behind the stream, paces file sources to the clip rate
+        """
+        pos = self.video.get(self.cv2.CAP_PROP_POS_MSEC)/1000.0
+
+        # no stream timestamps: buffered frame (returned without waiting) the consumer could not keep up with
+        if pos <= self.last_pos:
+            return t1 - t0 < self.drain_threshold and self.frame_seq != self.read_seq
+        self.last_pos = pos
+
+        if self.t_offset is None: self.t_offset = t1 - pos
+
+        # file: serve at the clip rate, nothing is behind while we keep up
+        if self.video_file:
+            dt = self.t_offset + pos - time.perf_counter()
+            if dt > 0: self.video_ev.wait(dt)
+
+        lag = time.perf_counter() - (self.t_offset + pos)
+        if lag < 0:
+            # less delayed frame than before, new reference
+            self.t_offset += lag
+            lag = 0.0
+
+        return lag > self.drain_lag
+
+    def __publish(self, frame):
+        """Publish the frame into the shared memory ring, if enabled
+        """
+        with self.ring_lock:
+            if self.ring is None:
+                return
+
+            self.ring.publish(frame)
+
+    def open_video(self):
+        """Open the video stream, blocks till the stream is available.
+        Called by the video thread if the stream was not opened before.
+        """
+        if self.low_latency:
+            # no buffering in the ffmpeg backend, must be set before opening
+            os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', 'fflags;nobuffer|flags;low_delay')
+
+            # bounded open / read, so a stalled stream is detected
+            params = []
+            for prop, val in (('CAP_PROP_OPEN_TIMEOUT_MSEC', 5000), ('CAP_PROP_READ_TIMEOUT_MSEC', int(self.stall_timeout*1000))):
+                if hasattr(self.cv2, prop): params += [getattr(self.cv2, prop), val]
+
+            if len(params) > 0:
+                self.video = self.cv2.VideoCapture(self.video_source, self.cv2.CAP_FFMPEG, params)
+            else:
+                self.video = self.cv2.VideoCapture(self.video_source, self.cv2.CAP_FFMPEG)
+            self.video.set(self.cv2.CAP_PROP_BUFFERSIZE, 1)
+            self.t_grab_ok = time.perf_counter()
+            self.t_offset = None
+            self.last_pos = -1.0
+        else:
+            self.video = self.cv2.VideoCapture(self.video_source)
+
+    def request_video_reopen(self):
+        """Ask the video thread to reopen the stream. Without LOW_LATENCY a blocked read can't be interrupted.
+        """
+        self.video_reopen = True
+
+    def reopen_video(self):
+        """Reopen the video stream, waits with exponential backoff between attempts
+        """
+        if self.video is not None: self.video.release()
+
+        self.video_ev.wait(self.reconnect_backoff)
+        self.reconnect_backoff = min(2*self.reconnect_backoff, 5.0)
+
+        # tello may have stopped the stream
+        if self.debug == False: self.send_cmd('streamon')
+
+        self.open_video()
+        self.video_stats['reconnects'] += 1
+
     def add_periodic_event(self,cmd,period,info=''):
         """Add periodic commands to the list
 
@@ -133,39 +361,111 @@ class TelloConnect:
                     #is time to run the command
                     cmd = ev['cmd']
                     info = ev['info']
-                    ret = self.send_cmd_return(cmd).rstrip()
+                    ret = self.send_cmd_return(cmd)
                     # if self.debug:
                     #     print (str(cmd) + ": " + str(ret))
 
-                    #update info field
-                    ev['val'] = str(ret)
-                
-            # scheduler base time ~ 100 ms
-            self.timer_ev.wait(0.1)
+                    #update info field, None if no answer
+                    ev['val'] = str(ret).rstrip()
                 
-            self.count +=1
-        except Exception:
-            pass
+        except Exception as e:
+            self.__error('periodic', e)
+
+        # scheduler base time ~ 100 ms
+        self.timer_ev.wait(0.1)
+
+        self.count +=1
+
+    def __error(self, channel, e):
+        """Count a link error, do not spin on a broken socket
+        """
+        if channel == 'video':
+            self.video_stats['errors'] += 1
+            self.video_stats['last_error'] = str(e)
+        else:
+            self.link_errors[channel] += 1
+        self.last_error = channel + ': ' + str(e)
+        if self.debug: print (self.last_error)
+        self.link_ev.wait(0.05)
+
+    def __bind(self, addr):
+        """UDP socket bound to addr, with receive timeout
+        """
+        sock = self.socket.socket(self.socket.AF_INET, self.socket.SOCK_DGRAM)
+        sock.settimeout(self.sock_timeout)
+        sock.bind(addr)
+        return sock
+
+    def rebind_sockets(self):
+        """Close and bind again the command and state sockets.
+        A socket is swapped by its own receive thread, a recvfrom() blocked on a closed socket is not woken up.
+        """
+        self.rebind.update(('cmd', 'state'))
+
+        # no receive thread running, swap right away
+        if self.receiverThread.is_alive() is not True: self.__rebind('cmd')
+        if self.stateThread.is_alive() is not True: self.__rebind('state')
+
+    def __rebind(self, channel):
+        """Swap the socket of the channel, retried in the next cycle on failure
+        """
+        name, addr = ('sock_cmd', self.localaddr) if channel == 'cmd' else ('sock_state', self.stateaddr)
+        try:
+            getattr(self, name).close()
+            setattr(self, name, self.__bind(addr))
+            self.rebind.discard(channel)
+        except OSError as e:
+            self.__error(channel, e)
 
     def __receive(self):
         """Receive UDP return string
         """
+        if 'cmd' in self.rebind: self.__rebind('cmd')
+
         try:
             data, _ = self.sock_cmd.recvfrom(2048)
-            self.udp_cmd_ret = data.decode(encoding="utf-8")
-            self.cmd_recv_ev.set()
-        except Exception:
-            pass
+        except self.socket.timeout:
+            return
+        except Exception as e:
+            self.__error('cmd', e)
+            return
+
+        self.udp_cmd_ret = data.decode(encoding="utf-8")
+        self.t_ack = time.perf_counter()
+        self.link_counts['acks'] += 1
+        self.cmd_recv_ev.set()
 
     def __state_receive(self):
         """Receive UDP return string
         """
-        data, _ = self.sock_state.recvfrom(512)
-        val = data.decode(encoding="utf-8").rstrip()
+        if 'state' in self.rebind: self.__rebind('state')
+
+        try:
+            data, _ = self.sock_state.recvfrom(512)
+            val = data.decode(encoding="utf-8").rstrip()
+        except self.socket.timeout:
+            return
+        except Exception as e:
+            self.__error('state', e)
+            return
 
         # data split
         self.state_value = val.replace(';',':').split(':')
 
+        t = time.perf_counter()
+        self.t_state = t
+        self.link_counts['states'] += 1
+        for listener in self.state_listeners:
+            listener(self.state_value, t)
+
+    def add_state_listener(self, listener):
+        """Register a callback for the state packets
+
+        Args:
+            listener (callable): called with (state_value, time.perf_counter()) in the state thread
+        """
+        self.state_listeners.append(listener)
+
     def stop_communication(self):
         """Close commnucation threads
         """
@@ -173,48 +473,74 @@ class TelloConnect:
         self.stateThread.stop()
         self.eventThread.stop()
 
-        # close the socket too
+        # close the sockets too
         self.sock_cmd.close()
+        self.sock_state.close()
 
     def start_communication(self):
         """Start low level communication
         """
         # start communication / listens to UDP
-        if self.receiverThread.isAlive() is not True: self.receiverThread.start()
-        if self.eventThread.isAlive() is not True:  self.eventThread.start()
-        if self.stateThread.isAlive() is not True:  self.stateThread.start()
+        if self.receiverThread.is_alive() is not True: self.receiverThread.start()
+        if self.eventThread.is_alive() is not True:  self.eventThread.start()
+        if self.stateThread.is_alive() is not True:  self.stateThread.start()
         
 
     def start_video(self):
         """Start video stram
         """
+        # created before the stream, a name in use fails here, not in the video thread
+        if self.shm_name != '' and self.ring is None:
+            self.ring = framering.FrameRingWriter(self.shm_name, SHAPE=(self.image_size[1],self.image_size[0],3), SLOTS=self.shm_slots)
+
         self.send_cmd('streamon')
-        if self.videoThread.isAlive() is not True:  self.videoThread.start()
+        if self.videoThread.is_alive() is not True:  self.videoThread.start()
 
     def stop_video(self):
         """Stop video stream
         """
         self.send_cmd('streamoff')
         self.videoThread.stop()
+        self.video_ev.set()
+
+        # remove the shared memory ring, attached readers keep their mapping till they close
+        with self.ring_lock:
+            ring, self.ring = self.ring, None
+            if ring is not None: ring.close()
   
-    def wait_till_connected(self):
+    def wait_till_connected(self, TIMEOUT=None):
         """
         Blocking command to wait till Tello is available
         Use this command at program startup, to determin connection status
+
+        Args:
+            TIMEOUT (float, optional): give up after TIMEOUT seconds, None - wait forever. Defaults to None.
+
+        Returns:
+            bool: True if connected
+
+        Raises:
+            ConnectionError: command can't be sent, e.g. not on the tello wifi
         """
-        self.receiverThread.start()
+        if self.receiverThread.is_alive() is not True: self.receiverThread.start()
 
+        t_start = time.perf_counter()
         while True:
             try:
                 ret = self.send_cmd_return('command')
-                
-                # force tello to 'DEBUG' mode
-                if self.debug== True: ret = "OK"
+            except OSError as e:
+                # no tello needed in 'DEBUG' mode
+                if self.debug == False: raise ConnectionError("Tello not reachable: " + str(e)) from e
+                ret = None
+
+            # force tello to 'DEBUG' mode
+            if self.debug== True: ret = "OK"
 
-            except Exception:
-                exit()
             if str(ret) != 'None':
-                break
+                return True
+
+            if TIMEOUT is not None and time.perf_counter() - t_start > TIMEOUT:
+                return False
 
 
     def send_cmd_return(self,cmd):
@@ -226,8 +552,9 @@ class TelloConnect:
         Returns:
             [str]: UPD aswer to the emmited command, see Tello SDK for valid answers
         """
-        # send cmd over UDP
+        # send cmd over UDP, drop an answer that arrived for an earlier command
         self.udp_cmd_ret = None
+        self.cmd_recv_ev.clear()
         cmd = cmd.encode(encoding="utf-8")
         _ = self.sock_cmd.sendto(cmd, self.telloaddr)
 
@@ -239,17 +566,28 @@ class TelloConnect:
         
         return self.udp_cmd_ret
     
-    def send_cmd(self,cmd):
+    def send_cmd(self,cmd,FORCE=False):
         """Send a command to Tello over UDP, do not wait for the return value
 
         Args:
             cmd (str): See Tello SDK for walid commands
+            FORCE (bool, optional): send 'rc' commands during failsafe too. Defaults to False.
 
         Returns:
             [str]: UPD aswer to the emmited command, see Tello SDK for valid answers
         """
+        # tracker commands are computed from stale data during failsafe
+        if self.failsafe and not FORCE and cmd.startswith('rc'):
+            return
+
         # send cmd over UDP
+        if self.t_first_rc is None and cmd.startswith('rc'): self.t_first_rc = time.perf_counter()
         cmd = cmd.encode(encoding="utf-8")
-        _ = self.sock_cmd.sendto(cmd, self.telloaddr)
+        try:
+            _ = self.sock_cmd.sendto(cmd, self.telloaddr)
+        except OSError as e:
+            # socket closed / rebound, the link supervisor handles the recovery
+            self.link_errors['send'] += 1
+            self.last_error = 'send: ' + str(e)
 
 